@@ -11,6 +11,9 @@ import acb.common
 import acb.date
 
 
+# The first cell of the header row.
+HEADER = 'Transaction Date'
+
 CIBC_DATE = re.compile('^[A-Za-z]+ [0123][0-9], 20\d{2}$')
 CIBC_TX_TYPES = {'Sell': acb.common.TRANS_SELL,
                  'Buy': acb.common.TRANS_BUY,
@@ -41,7 +44,7 @@ def InferSymbol(d):
   raise Exception('Unknown property: %s' % d['Description'])
 
   
-def Process(src, func):
+def Process(src, func, symbols=None, last_year=None):
   """Parses data from a CIBC Investors Edge exported CSV file.
   
   Reads lines from the provided |src| (an IO object), parses records, and emits
@@ -51,12 +54,14 @@ def Process(src, func):
   Args:
     src: An input IO object.
     func: A function that will receive 
+    symbols: If given, only records of these symbols are parsed.
+    last_year: If given, only records up to the end of this year are parsed.
   """
   reader = csv.reader(src)
   
   # Find the header line.
   for row in reader:
-    if len(row) > 0 and row[0] == 'Transaction Date':
+    if len(row) > 0 and row[0] == HEADER:
       break
   header = row
   
@@ -65,6 +70,8 @@ def Process(src, func):
     # Continue as long as we encounter valid records.
     if len(row) == 0 or not CIBC_DATE.match(row[0]):
       break
+    if last_year is not None and int(row[0][-4:]) > last_year:
+      continue
     d = {}
     for i in xrange(min(len(header), len(row))):
       if row[i]:
@@ -87,9 +94,14 @@ def Process(src, func):
     if re.search('NAME CHANGE', d['Description']):
       continue
 
-    # Parse the transaction date and symbol.
-    day = datetime.datetime.strptime(d['Transaction Date'], '%B %d, %Y')
+    # Infer the symbol, skipping the records of other symbols before parsing
+    # them.
     sym = InferSymbol(d)
+    if symbols is not None and sym not in symbols:
+      continue
+
+    # Parse the transaction date.
+    day = datetime.datetime.strptime(d['Transaction Date'], '%B %d, %Y')
 
     if tx_type == acb.common.TRANS_DIVIDEND or tx_type == acb.common.TRANS_FEE:
       v = float(CIBC_NUMBER.sub('', d['Amount']))
@@ -100,7 +112,8 @@ def Process(src, func):
           type=tx_type,
           units=0,
           value=acb.common.CurrencyAmount(d['Currency of Amount'], v),
-          fees=acb.common.CurrencyAmount('CAD', 0.0))
+          fees=acb.common.CurrencyAmount('CAD', 0.0),
+          source=reader.line_num)
       func(t)
       continue
 
@@ -121,5 +134,6 @@ def Process(src, func):
         type=tx_type,
         units=u,
         value=acb.common.CurrencyAmount(d['Currency of Amount'], v),
-        fees=acb.common.CurrencyAmount('CAD', f))
+        fees=acb.common.CurrencyAmount('CAD', f),
+        source=reader.line_num)
     func(t)
@@ -37,9 +37,13 @@ TRANS_FEE = 'FEE'
 #   units: The number of items of property involved in the transaction.
 #   value: Per property item value, as a CurrencyAmount.
 #   fees: Any fees associated with the transaction, as a CurrencyAmount.
+#   source: Where the transaction was read from, or None. Importers set this
+#           to the line number of the record, and acb.importers.Load to a
+#           (path, line number) tuple.
 Transaction = namedtuple(
 		'Transaction',
-		'date settlement_date symbol type units value fees')
+		'date settlement_date symbol type units value fees source')
+Transaction.__new__.__defaults__ = (None,)
 
 
 def TransactionComparator(tx1, tx2):
@@ -1,30 +1,40 @@
 #!/usr/bin/env python
 """Utility functions for retrieving currency conversion rates online."""
 
-import copy
 import csv
 import datetime
 import logging
 import os
 import re
+import time
 import urllib2
 
+import numpy
+
 import acb.common
 import acb.memo
+import acb.ratestore
 
 
 LOGGER = logging.getLogger(__name__)
 
 
-# Bank of Canada's URL for downloading US dollar rates as a CSV file.
-# The date is to be expanded using strftime. They are reported in the
-# order (noon, close, high, low).
-BOC_DAILY_URL = ('http://www.bankofcanada.ca/stats/results//csv?lP='
-                 'lookup_daily_exchange_rates.php'
-                 '&sR=2005-03-02&se=_0101-_0102-_0103-_0104&dF=%Y-%m-%d&dT=')
-
 BOC_DAILY_WHENS = ('daily noon', 'daily close', 'daily high', 'daily low')
 
+# BOC URL for downloading the daily (noon, close, high, low) rates over a range
+# of dates. The dates are to be expanded as YYYY-MM-DD.
+BOC_DAILY_RANGE_URL = ('http://www.bankofcanada.ca/stats/results/csv?lP='
+                       'lookup_daily_exchange_rates.php'
+                       '&sR=2005-03-02&se=_0101-_0102-_0103-_0104'
+                       '&dF=%(start)s&dT=%(end)s')
+
+# The name of the USD to CAD currency pair in the rate store.
+USD_CAD_PAIR = 'USD/CAD'
+
+# The number of days fetched ahead of a range of daily rates, so that a range
+# starting on a weekend or bank holiday can use the preceding banking day.
+HOLIDAY_LOOKBACK_DAYS = 7
+
 # BOC URL for downloading monthly exchange rates in CSV format.
 # The data is to be expanded using strftime. They are reported in the
 # order (noon, close, high, low, 90-day-noon, 90-day-closing).
@@ -33,9 +43,21 @@ BOC_MONTHLY_URL = ('http://www.bankofcanada.ca/stats/results//csv?endRange='
     'lookup_monthly_exchange_rates.php&sR=2005-04-01&se=L_IEXM0101-L_IEXM0102-'
     'L_IEXM0103-L_IEXM0104-L_IEXM0105-L_IEXM0106')
 
-BOC_YEARLY_NOONS_URL =('http://www.bankofcanada.ca/stats/results/csv?lP='
-                       'lookup_daily_exchange_rates.php&sR=2006-06-15&se=_0101&'
-                       'dF=%(year)d-01-01&dT=%(year)d-%(month)02d-%(day)02d')
+# BOC URL for downloading the daily noon rates over a range of dates. The
+# dates are to be expanded as YYYY-MM-DD.
+BOC_NOONS_URL = ('http://www.bankofcanada.ca/stats/results/csv?lP='
+                 'lookup_daily_exchange_rates.php&sR=2006-06-15&se=_0101&'
+                 'dF=%(start)s&dT=%(end)s')
+
+# BOC Valet URL for downloading the daily rates of other currencies over a
+# range of dates. The currency is to be expanded as its ISO code and the dates
+# as YYYY-MM-DD.
+BOC_VALET_URL = ('https://www.bankofcanada.ca/valet/observations/'
+                 'FX%(currency)sCAD/csv?start_date=%(start)s&end_date=%(end)s')
+
+# The name of the daily noon rate series of a currency in the rate store. The
+# currency is to be expanded as its ISO code.
+NOON_SERIES = '%s/CAD daily noon'
 
 BOC_MONTHLY_WHENS = ('monthly noon', 'monthly close', 'monthly high',
                      'monthly low', '90-day noon', '90-day close')
@@ -43,8 +65,21 @@ BOC_MONTHLY_WHENS = ('monthly noon', 'monthly close', 'monthly high',
 # The full list 'whens' for BOC rates.
 BOC_WHENS = BOC_DAILY_WHENS + BOC_MONTHLY_WHENS + ('annual',)
 
+# The number of calendar days, ending on the last day of a month, averaged by
+# the 90-day rates of that month.
+AVERAGE_DAYS = 90
+
+# The largest relative difference between a derived rate and the official rate
+# tolerated by VerifyUsdToCadAggregateRates.
+VERIFY_TOLERANCE = 1e-4
+
+# Whether the derived monthly and annual rates are checked against the
+# official rates, where available, when first used.
+VERIFY_AGGREGATE_RATES = False
+
 # The table of BOC annual USD to CAD exchange rates. Taken from
 # http://www.bankofcanada.ca/rates/exchange/annual-average-exchange-rates/
+# These are only used to verify the derived annual rates.
 BOC_ANNUAL_RATES = {
   2014: 1.10446640,
   2013: 1.02991480,
@@ -53,8 +88,36 @@ BOC_ANNUAL_RATES = {
 }
 
 
-@acb.memo.memo
-@acb.memo.memosql
+def FetchUsdToCadDailyRates(start, end):
+  """Fetches the daily USD -> CAD rates from |start| to |end| inclusive.
+
+  Returns:
+    A dict of date strings to lists of (noon, close, high, low) rates. Only
+    banking days are present.
+  """
+  url = BOC_DAILY_RANGE_URL % {'start': acb.ratestore.FormatDate(start),
+                               'end': acb.ratestore.FormatDate(end)}
+  LOGGER.debug('Requesting Bank of Canada USD to CAD daily rates from %s to '
+               '%s.', start, end)
+  reader = csv.reader(urllib2.urlopen(url))
+  rates = {}
+  for row in reader:
+    if len(row) != 5 or not re.match('^\d{4}-\d{2}-\d{2}$', row[0].strip()):
+      continue
+    values = [v.strip() for v in row[1:]]
+    # Bank holidays are reported as 'Not available' or as negative values.
+    if not all(re.match('^\d+\.\d+$', v) for v in values):
+      continue
+    rates[row[0].strip()] = map(float, values)
+  return rates
+
+
+# The provider of daily USD -> CAD rate tables. Setting its |fetch| to None
+# restricts it to rates that are already cached.
+USD_CAD_DAILY_RATES = acb.ratestore.TieredDailyRates(
+    USD_CAD_PAIR, FetchUsdToCadDailyRates, HOLIDAY_LOOKBACK_DAYS)
+
+
 def GetUsdToCadDailyRateTable(date):
   """Gets the full table of daily USD -> CAD currency rates.
   
@@ -64,46 +127,50 @@ def GetUsdToCadDailyRateTable(date):
     weekend.
   
   Note:
-    This function is memoized to memory and to a persistent database.
+    Tables are served from memory, then from the rate store, and only then
+    fetched. Weekends and bank holidays are cached as references to the
+    preceding banking day, so they are never fetched again.
   """
-  url = date.strftime(BOC_DAILY_URL)
-  if date.strftime('%Y-%m-%d') == '2015-04-25':
-    LOGGER.setLevel(logging.DEBUG)
-  LOGGER.debug('Requesting Bank of Canada USD to CAD daily rates for %s.', date)
-  reader = csv.reader(urllib2.urlopen(url))
-  for row in reader:
-    if len(row) > 8 and row[0] == 'Low':
-      if row[2] == 'Not available':
-        LOGGER.debug('%s was a bank holiday, checking the day before.', date)
-        previous_day = date - datetime.timedelta(days=1)
-        rates = GetUsdToCadDailyRateTable(previous_day)
-        # Use the previous closing rate as the exact rate for a banking holiday.
-        return [previous_day, rates[2], rates[2], rates[2], rates[2]]
-
-      noon = float(row[2])
-      close = float(row[4])
-      high = float(row[6])
-      low = float(row[8])
-
-      # Negative values are returned for bank holidays. Use the
-      # previously known closing rate. This will recurse until the
-      # closest earlier banking day is found.
-      if noon < 0:
-        LOGGER.debug('%s was a bank holiday, checking the day before.', date)
-        previous_day = date - datetime.timedelta(days=1)
-        rates = GetUsdToCadDailyRateTable(previous_day)
-        # Use the previous closing rate as the exact rate for a banking holiday.
-        return [previous_day, rates[2], rates[2], rates[2], rates[2]]
-
-      return [date, noon, close, high, low]
-  
-  raise Exception('Rates not found in downloaded data.')
+  return USD_CAD_DAILY_RATES.Get(date)
+
+
+def PrefetchUsdToCadDailyRates(start, end):
+  """Populates the daily USD -> CAD rate tables from |start| to |end|.
+
+  All of the rates are retrieved in a single request, and a table is cached
+  for every day in the range, so that GetUsdToCadDailyRateTable is served
+  locally for any of them.
+  """
+  USD_CAD_DAILY_RATES.Prefetch(start, end)
+
+
+def PrefetchRates(start, end, when='daily noon', currencies=('USD',)):
+  """Retrieves the |currencies| -> CAD rates |when| for every day from |start|
+  to |end|.
+
+  This batches what would otherwise be a request per date into as few
+  requests as possible.
+  """
+  if when == 'daily noon':
+    for currency in currencies:
+      if currency == 'CAD':
+        continue
+      for year in xrange(start.year, end.year + 1):
+        GetNoonRateTableForYear(currency, year)
+  elif when in BOC_DAILY_WHENS and 'USD' in currencies:
+    PrefetchUsdToCadDailyRates(start, end)
+  elif 'USD' in currencies:
+    for year in xrange(start.year, end.year + 1):
+      GetUsdToCadAggregateRates(year)
 
 
 @acb.memo.memo
 @acb.memo.memosql
 def GetUsdToCadMonthlyRateTable(date):
-  """Gets the full table of monthly USD -> CAD currency rates.
+  """Gets the full table of official monthly USD -> CAD currency rates.
+
+  The monthly rates are otherwise derived from the daily rates, so this is
+  only used to verify them.
   
   Args:
     date: The date to be queried. Only the month and year will be used so for
@@ -131,21 +198,165 @@ def GetUsdToCadMonthlyRateTable(date):
   raise Exception('Rates not found in downloaded data.')
 
 
-@acb.memo.memo
-@acb.memo.memosql
-def GetUsdToCadNoonRateTableForYear(year):
-  # If we're midway through a year then cap the end date.
-  month = 12
-  day = 31
-  today = datetime.datetime.now()
-  if today.year == year:
-    month = today.month
-    day = today.day
-    print (year, month, day)
-
-  url = BOC_YEARLY_NOONS_URL % {'year':year, 'month':month, 'day':day}
-  LOGGER.debug('Requesting Bank of Canada USD to CAD noon rates for %d.', year)
-  reader = csv.reader(urllib2.urlopen(url))
+# In memory cache of the USD -> CAD rates derived from the daily rates, keyed
+# by year. Each value is a tuple of the last date covered, the monthly rates
+# and the annual rate.
+_AGGREGATE_RATES = {}
+
+
+def GetUsdToCadAggregateRates(year):
+  """Derives the monthly, 90-day and annual USD -> CAD rates of |year|.
+
+  The rates of a month are the means of the daily noon and close rates, and
+  the extrema of the daily high and low rates, over its banking days. The
+  90-day rates are the means over the AVERAGE_DAYS ending on the last day of
+  the month, and the annual rate is the mean of the daily noon rates. Every
+  month is computed at once, from a single range of stored daily rates.
+
+  Returns:
+    A tuple of a dict of months (1 to 12) to lists of (noon, close, high, low,
+    90noon, 90close) rates, and the annual rate. The current year only has the
+    months so far, and its rates are those to date. A month without any
+    banking days yet has the rates of the preceding month, and early in
+    January before any rates of the year are published, the annual rate is
+    that of the preceding year.
+
+  Note:
+    Results are cached in memory, closed years for good and the current year
+    until another day of rates becomes available.
+  """
+  today = datetime.date.today()
+  if year > today.year:
+    raise Exception('No rates are available for %d.' % year)
+  through = min(datetime.date(year, 12, 31),
+                today - datetime.timedelta(days=1))
+  cached = _AGGREGATE_RATES.get(year)
+  if cached is not None and cached[0] >= through:
+    return cached[1], cached[2]
+
+  first = datetime.date(year, 1, 1)
+  dates, rates = USD_CAD_DAILY_RATES.GetRange(
+      first - datetime.timedelta(days=AVERAGE_DAYS - 1), through)
+  in_year = dates >= numpy.datetime64(first, 'D')
+  if not in_year.any() and year != today.year:
+    raise Exception('No daily rates found for %d.' % year)
+
+  # Split the banking days of the year by month, and locate the start of the
+  # 90 day window ending on the last day of each month.
+  months = numpy.arange(numpy.datetime64('%d-01' % year, 'M'),
+                        numpy.datetime64(max(through, first), 'M') + 1)
+  month_starts = months.astype('datetime64[D]')
+  month_ends = (months + 1).astype('datetime64[D]') - 1
+  lo = numpy.searchsorted(dates, month_starts)
+  hi = numpy.searchsorted(dates, month_ends, side='right')
+  window_lo = numpy.searchsorted(dates, month_ends - (AVERAGE_DAYS - 1))
+  empty = hi <= lo
+
+  # Windowed sums from the cumulative sums, and extrema by reduction over the
+  # months with banking days.
+  sums = numpy.vstack([numpy.zeros(4), numpy.cumsum(rates, axis=0)])
+  counts = numpy.maximum(hi - lo, 1).astype(float)
+  noon = (sums[hi, 0] - sums[lo, 0]) / counts
+  close = (sums[hi, 1] - sums[lo, 1]) / counts
+  high = numpy.zeros(len(months))
+  low = numpy.zeros(len(months))
+  if not empty.all():
+    high[~empty] = numpy.maximum.reduceat(rates[:, 2], lo[~empty])
+    low[~empty] = numpy.minimum.reduceat(rates[:, 3], lo[~empty])
+  window = numpy.maximum(hi - window_lo, 1).astype(float)
+  noon90 = (sums[hi, 0] - sums[window_lo, 0]) / window
+  close90 = (sums[hi, 1] - sums[window_lo, 1]) / window
+
+  monthly = {}
+  previous = None
+  for i, month in enumerate(months):
+    if empty[i]:
+      if previous is None:
+        previous = GetUsdToCadAggregateRates(year - 1)[0][12]
+      monthly[i + 1] = list(previous)
+    else:
+      monthly[i + 1] = [noon[i], close[i], high[i], low[i], noon90[i],
+                        close90[i]]
+    previous = monthly[i + 1]
+  if in_year.any():
+    annual = rates[in_year, 0].mean()
+  else:
+    annual = GetUsdToCadAggregateRates(year - 1)[1]
+  LOGGER.debug('Derived USD to CAD rates of %d months of %d.',
+               len(monthly), year)
+  _AGGREGATE_RATES[year] = (through, monthly, annual)
+
+  if VERIFY_AGGREGATE_RATES:
+    VerifyUsdToCadAggregateRates(year)
+  return monthly, annual
+
+
+def VerifyUsdToCadAggregateRates(year, tolerance=VERIFY_TOLERANCE):
+  """Compares the derived rates of |year| to the official rates.
+
+  The official monthly rates are fetched, and the annual rate is taken from
+  BOC_ANNUAL_RATES when available.
+
+  Returns:
+    A list of (date, when, derived, official) for every rate differing by
+    more than |tolerance| relative to the official rate.
+  """
+  monthly, annual = GetUsdToCadAggregateRates(year)
+  checks = []
+  for month, rates in sorted(monthly.iteritems()):
+    date = datetime.datetime(year=year, month=month, day=1)
+    try:
+      official = GetUsdToCadMonthlyRateTable(date)
+    except Exception as e:
+      LOGGER.warning('No official monthly rates for %s: %s', date, e)
+      continue
+    checks.extend((date, when, rates[i], official[i])
+                  for i, when in enumerate(BOC_MONTHLY_WHENS))
+  if year in BOC_ANNUAL_RATES:
+    checks.append((datetime.datetime(year=year, month=1, day=1), 'annual',
+                   annual, BOC_ANNUAL_RATES[year]))
+
+  mismatches = []
+  for date, when, derived, official in checks:
+    if abs(derived - official) > tolerance * abs(official):
+      LOGGER.warning('Derived %s rate for %s of %f differs from the official '
+                     'rate of %f.', when, date.strftime('%Y-%m'), derived,
+                     official)
+      mismatches.append((date, when, derived, official))
+  return mismatches
+
+
+def FetchUsdToCadNoonRates(start, end):
+  """Fetches the daily USD -> CAD noon rates from |start| to |end| inclusive.
+
+  Returns:
+    A dict of date strings to rates. Days without a rate are omitted.
+  """
+  url = BOC_NOONS_URL % {'start': acb.ratestore.FormatDate(start),
+                         'end': acb.ratestore.FormatDate(end)}
+  LOGGER.debug('Requesting Bank of Canada USD to CAD noon rates from %s to %s.',
+               start, end)
+  return _ParseNoonRates(csv.reader(urllib2.urlopen(url)))
+
+
+def FetchNoonRates(currency, start, end):
+  """Fetches the daily |currency| -> CAD rates from |start| to |end| inclusive.
+
+  Returns:
+    A dict of date strings to rates. Days without a rate are omitted.
+  """
+  if currency == 'USD':
+    return FetchUsdToCadNoonRates(start, end)
+  url = BOC_VALET_URL % {'currency': currency,
+                         'start': acb.ratestore.FormatDate(start),
+                         'end': acb.ratestore.FormatDate(end)}
+  LOGGER.debug('Requesting Bank of Canada %s to CAD rates from %s to %s.',
+               currency, start, end)
+  return _ParseNoonRates(csv.reader(urllib2.urlopen(url)))
+
+
+def _ParseNoonRates(reader):
+  """Parses (date, rate) rows of a BOC CSV file into a dict."""
   rates = {}
   for row in reader:
     if len(row) != 2:
@@ -155,11 +366,201 @@ def GetUsdToCadNoonRateTableForYear(year):
     if re.match('^\d+\.\d+$', rate):
       rate = float(rate)
       rates[date] = rate
+  return rates
+
+
+# In memory cache of noon rate tables, keyed by currency and year. Each value
+# is a tuple of the last date covered, the rates and the time they were
+# retrieved.
+_NOON_RATE_TABLES = {}
+
+
+def _KnownCoverage(start, through, rates):
+  """Returns the last day through which rates fetched from |start| are final.
+
+  Days after the last of |rates| may still get rates of their own, unless they
+  are known holidays.
+
+  Args:
+    start: The first day fetched.
+    through: The last day that the fetch could cover.
+    rates: A dict of date strings to the rates fetched.
+
+  Returns:
+    The last day covered, which is before |start| if none is.
+  """
+  covered = start - datetime.timedelta(days=1)
+  if rates:
+    covered = max(acb.ratestore.ParseDate(d) for d in rates)
+  day = covered + datetime.timedelta(days=1)
+  while day <= through and acb.ratestore.IsKnownHoliday(day):
+    covered = day
+    day += datetime.timedelta(days=1)
+  return covered
+
+
+def GetNoonRateTableForYear(currency, year):
+  """Gets the daily |currency| -> CAD noon rates for |year|.
+
+  Returns:
+    A dict of date strings to rates. The same dict is returned for as long as
+    the rates are unchanged.
+
+  Note:
+    Rates are persisted to the rate store along with the last date they cover.
+    Closed years are only ever fetched once, while the current year is
+    extended with just the days that are missing since the last fetch. Days
+    not published yet are fetched again after acb.ratestore.REFETCH_SECONDS.
+  """
+  # The rate for today may not be published yet, so the current year is only
+  # considered covered through yesterday.
+  today = datetime.date.today()
+  if year > today.year:
+    raise Exception('No rates are available for %d.' % year)
+  last = min(datetime.date(year, 12, 31), today)
+  through = last
+  if through == today:
+    through -= datetime.timedelta(days=1)
+
+  cached = _NOON_RATE_TABLES.get((currency, year))
+  if cached is not None and (cached[0] >= through or
+                             time.time() - cached[2] <
+                             acb.ratestore.REFETCH_SECONDS):
+    return cached[1]
+
+  series = NOON_SERIES % currency
+  store = acb.ratestore.GetDefaultStore()
+  covered = store.GetCoverage(series, year)
+  if covered is None or covered < through:
+    # Another process may be fetching the same rates, so check again once
+    # they are done.
+    with store.Lock('%s %d' % (series, year)):
+      covered = store.GetCoverage(series, year)
+      if covered is None or covered < through:
+        start = datetime.date(year, 1, 1)
+        if covered is not None:
+          start = covered + datetime.timedelta(days=1)
+        rates = {}
+        if start <= last:
+          rates = FetchNoonRates(currency, start, last)
+        # Only advance the coverage over the days known to be final.
+        fetched = _KnownCoverage(start, through, rates)
+        if fetched >= start:
+          store.AddRates(series, year, rates, fetched)
+          covered = fetched
+
+  rates = store.GetRates(series, year)
   if len(rates) == 0:
     raise Exception('Failed to fetch annual list of daily rates.')
+  _NOON_RATE_TABLES[(currency, year)] = (covered, rates, time.time())
   return rates
 
 
+def GetUsdToCadNoonRateTableForYear(year):
+  """Gets the daily USD -> CAD noon rates for |year|."""
+  return GetNoonRateTableForYear('USD', year)
+
+
+# In memory caches of noon rates as arrays, keyed by currency and year, and of
+# derived cross-rates, keyed by currency pair and year.
+_NOON_RATE_ARRAYS = {}
+_CROSS_RATE_SERIES = {}
+
+
+def _GetNoonRateArrays(currency, year):
+  """Returns the |currency| -> CAD noon rates of |year| as sorted arrays.
+
+  Returns:
+    A tuple of the noon rate table the arrays were derived from, an array of
+    dates and an array of rates.
+  """
+  cached = _NOON_RATE_ARRAYS.get((currency, year))
+  table = GetNoonRateTableForYear(currency, year)
+  if cached is not None and cached[0] is table:
+    return cached
+  dates = sorted(table.iterkeys())
+  arrays = (table, numpy.array(dates, dtype='datetime64[D]'),
+            numpy.array([table[d] for d in dates]))
+  _NOON_RATE_ARRAYS[(currency, year)] = arrays
+  return arrays
+
+
+def GetNoonRateSeries(currency_from, currency_to, year):
+  """Gets the daily noon rates from |currency_from| to |currency_to|.
+
+  Every pair is derived through CAD from the stored |currency| -> CAD noon
+  rates. Rates are forward-filled over the union of the banking days of both
+  currencies. The derived series is computed once and cached until either of
+  the underlying noon rate tables changes.
+
+  Returns:
+    A tuple of an array of dates and an array of rates, sorted by date.
+  """
+  key = (currency_from, currency_to, year)
+  bases = [None, None]
+  for i, currency in enumerate((currency_from, currency_to)):
+    if currency != 'CAD':
+      bases[i] = _GetNoonRateArrays(currency, year)
+
+  cached = _CROSS_RATE_SERIES.get(key)
+  if (cached is not None and cached[0] is bases[0] and
+      cached[1] is bases[1]):
+    return cached[2], cached[3]
+
+  dates = numpy.unique(numpy.concatenate(
+      [b[1] for b in bases if b is not None]))
+  rates = numpy.ones(len(dates))
+  valid = numpy.ones(len(dates), dtype=bool)
+  for i, base in enumerate(bases):
+    if base is None:
+      continue
+    # Forward-fill each base series onto the common dates.
+    index = numpy.searchsorted(base[1], dates, side='right') - 1
+    valid &= index >= 0
+    values = base[2][numpy.maximum(index, 0)]
+    if i == 0:
+      rates *= values
+    else:
+      rates /= values
+  dates = dates[valid]
+  rates = rates[valid]
+  LOGGER.debug('Derived %d %s to %s noon rates for %d.',
+               len(rates), currency_from, currency_to, year)
+  _CROSS_RATE_SERIES[key] = (bases[0], bases[1], dates, rates)
+  return dates, rates
+
+
+def GetDailyNoonRates(currency_from, currency_to, days):
+  """Gets the noon rates from |currency_from| to |currency_to| for |days|.
+
+  Args:
+    currency_from: The currency to convert from.
+    currency_to: The currency to convert to.
+    days: A sorted array of dates, as numpy datetime64[D].
+
+  Returns:
+    An array of rates, one per day. Days without a rate of their own use the
+    rate of the closest earlier banking day.
+  """
+  if currency_from == currency_to or len(days) == 0:
+    return numpy.ones(len(days))
+  first = days[0].astype(datetime.date).year
+  last = days[-1].astype(datetime.date).year
+  # Include the previous year if available, for days preceding the first
+  # banking day.
+  series = []
+  for year in xrange(first - 1, last + 1):
+    try:
+      series.append(GetNoonRateSeries(currency_from, currency_to, year))
+    except Exception:
+      if year != first - 1:
+        raise
+  dates = numpy.concatenate([s[0] for s in series])
+  rates = numpy.concatenate([s[1] for s in series])
+  index = numpy.searchsorted(dates, days, side='right') - 1
+  return numpy.where(index >= 0, rates[numpy.maximum(index, 0)], numpy.nan)
+
+
 def GetUsdToCadRateTable(date):
   """Gets the complete set of USD -> CAD currency rates.
   
@@ -169,9 +570,9 @@ def GetUsdToCadRateTable(date):
   Returns:
     A dictionary of rate names to their values.
   """
-  first_of_month = datetime.datetime(year=date.year, month=date.month, day=1)
   dailies = GetUsdToCadDailyRateTable(date)
-  monthlies = GetUsdToCadMonthlyRateTable(first_of_month)
+  monthly, annual = GetUsdToCadAggregateRates(date.year)
+  monthlies = monthly[date.month]
 
   d = {'date': dailies[0] }
   for i in xrange(0, len(BOC_DAILY_WHENS)):
@@ -184,12 +585,38 @@ def GetUsdToCadRateTable(date):
     rate = monthlies[i]
     d[when] = rate
 
-  if date.year in BOC_ANNUAL_RATES:
-    d['annual'] = BOC_ANNUAL_RATES[date.year]
+  d['annual'] = annual
 
   return d
 
-      
+
+def GetRateTable(currency, date):
+  """Gets the set of |currency| -> CAD currency rates.
+
+  The full set of rates is only published for USD. Other currencies only have
+  the daily noon rate.
+  """
+  if currency == 'CAD':
+    d = dict((when, 1.0) for when in BOC_WHENS)
+    d['date'] = date
+    return d
+  if currency == 'USD':
+    return GetUsdToCadRateTable(date)
+  return {'date': date,
+          'daily noon': GetConversionRate(currency, 'CAD', date, 'daily noon')}
+
+
+# In memory cache of derived conversion rate tables, keyed by currency pair
+# and date. Only the dates of closed years are cached, as the monthly, 90-day
+# and annual rates of the current year still change.
+_CONVERSION_RATE_TABLES = {}
+
+
+def _IsClosedYear(date):
+  """Returns whether the year of |date| is over, so that its rates are final."""
+  return date.year < datetime.date.today().year
+
+
 def GetConversionRateTable(currency_from, currency_to, date):
   """Returns the conversion rate table from |currency_from| to |currency_to|.
   
@@ -204,24 +631,26 @@ def GetConversionRateTable(currency_from, currency_to, date):
     highest rate and the day's lowest rate. The date of the rate retrieval is
     also returned, as the original requested date may have been a bank holiday.
     The data as a dictionary mapping rate names to their values, and with a
-    'date' key for the actual date associated with the returned rates.
+    'date' key for the actual date associated with the returned rates. Pairs
+    not involving CAD are derived through CAD, and only contain the rates
+    available for both currencies. The returned dict must not be modified.
   """
-  # Handle no-op conversions.
-  if currency_from == currency_to:
-    return [date, 1.0, 1.0, 1.0, 1.0]
-
   if currency_from == 'USD' and currency_to == 'CAD':
-    rates = GetUsdToCadRateTable(date)
-    return rates
-  elif currency_from == 'CAD' and currency_to == 'USD':
-    rates = GetUsdToCadRateTable(date)
-    # Invert the rates.
-    for k in rates.iterkeys():
-      if k != 'date':
-        rates[k] = 1.0 / rates[k]
-    return rates
-  else:
-    raise Exception('Unsupported conversion: %s -> %s' % (currency_from, currency_to))
+    return GetUsdToCadRateTable(date)
+
+  key = (currency_from, currency_to, date)
+  if key in _CONVERSION_RATE_TABLES:
+    return _CONVERSION_RATE_TABLES[key]
+
+  rates_from = GetRateTable(currency_from, date)
+  rates_to = GetRateTable(currency_to, date)
+  rates = {'date': rates_from['date']}
+  for when in BOC_WHENS:
+    if when in rates_from and when in rates_to:
+      rates[when] = rates_from[when] / rates_to[when]
+  if _IsClosedYear(date):
+    _CONVERSION_RATE_TABLES[key] = rates
+  return rates
 
 
 def GetConversionRate(currency_from, currency_to, date, when='daily noon'):
@@ -237,16 +666,21 @@ def GetConversionRate(currency_from, currency_to, date, when='daily noon'):
     The value of one unit of |currency_from| in |currency_to|, at the provided
     time |when|.
   """
+  # Handle no-op conversions.
+  if currency_from == currency_to:
+    return 1.0
+
   if when == 'daily noon':
-    rates = None
-    d = copy.deepcopy(date)
+    # Use the rate of the closest banking day on or before the date, which
+    # may be in an earlier year.
+    day = numpy.datetime64(acb.ratestore.FormatDate(date), 'D')
+    year = date.year
     while True:
-      if d.year != date.year or rates == None:
-        rates = GetUsdToCadNoonRateTableForYear(d.year)
-      s = d.strftime('%Y-%m-%d')
-      if s in rates:
-        return rates[s]
-      d -= datetime.timedelta(days=1)
+      dates, rates = GetNoonRateSeries(currency_from, currency_to, year)
+      i = numpy.searchsorted(dates, day, side='right')
+      if i > 0:
+        return float(rates[i - 1])
+      year -= 1
 
   rates = GetConversionRateTable(currency_from, currency_to, date)
   if when not in rates:
@@ -254,8 +688,53 @@ def GetConversionRate(currency_from, currency_to, date, when='daily noon'):
   return rates[when]
 
 
+# In memory cache of conversion rates under several policies, keyed by currency
+# pair, date and policies. As above, only closed years are cached.
+_CONVERSION_RATES = {}
+
+
+def GetConversionRates(currency_from, currency_to, date, whens):
+  """Returns the conversion rates from |currency_from| to |currency_to|.
+
+  Args:
+    currency_from: The currency to convert from.
+    currency_to: The currency to convert to.
+    date: The date of the query.
+    whens: A tuple of the times of the exchange.
+
+  Returns:
+    An array of the values of one unit of |currency_from| in |currency_to|,
+    one for each of |whens|.
+  """
+  key = (currency_from, currency_to, date, whens)
+  if key in _CONVERSION_RATES:
+    return _CONVERSION_RATES[key]
+
+  # All rates but the daily noon rate share a single rate table.
+  table = None
+  rates = numpy.ones(len(whens))
+  for i, when in enumerate(whens):
+    if currency_from == currency_to:
+      break
+    if when == 'daily noon':
+      rates[i] = GetConversionRate(currency_from, currency_to, date, when)
+      continue
+    if table is None:
+      table = GetConversionRateTable(currency_from, currency_to, date)
+    if when not in table:
+      raise Exception('Invalid rate type.')
+    rates[i] = table[when]
+  if _IsClosedYear(date):
+    _CONVERSION_RATES[key] = rates
+  return rates
+
+
 def Convert(currency_amount, currency_to, date, when='daily noon'):
-  """Performs a currency conversion."""
+  """Performs a currency conversion.
+
+  |when| may also be a tuple of times of the exchange, in which case the
+  amount is converted under each of them and returned as an array.
+  """
   # Handle no-op conversions.
   if currency_amount.currency == currency_to:
     return currency_amount
@@ -266,7 +745,12 @@ def Convert(currency_amount, currency_to, date, when='daily noon'):
         currency_to, 0.0)
 
   # Get the full conversion rate table.
-  rate = GetConversionRate(currency_amount.currency, currency_to, date, when)
+  if isinstance(when, tuple):
+    rate = GetConversionRates(
+        currency_amount.currency, currency_to, date, when)
+  else:
+    rate = GetConversionRate(
+        currency_amount.currency, currency_to, date, when)
   value = acb.common.CurrencyAmount(
       currency_to, currency_amount.amount * rate)
   return value
@@ -298,5 +782,4 @@ if __name__ == '__main__':
   print GetConversionRate('USD', 'CAD', datetime.datetime(year=2013, month=12, day=31), '90-day close')
   print GetConversionRate('USD', 'CAD', datetime.datetime(year=2013, month=12, day=31), 'annual')
 
-  acb.memo.KillDatabase(GetUsdToCadDailyRateTable)
   acb.memo.KillDatabase(GetUsdToCadMonthlyRateTable)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Streaming de-duplication of transactions from overlapping exported files.
+
+Exports of the same account often cover overlapping date ranges. Each
+transaction is fingerprinted, and a transaction is dropped when an earlier file
+covering its date already had as many transactions with the same fingerprint.
+Transactions that are repeated within a single file, such as two identical
+trades on the same day, are therefore preserved, unless an earlier file
+already had them too.
+
+The fingerprints of each file are kept for the whole run, scoped to the date
+range of that file, so that only the files covering the date of a transaction
+are ever looked up. Once a file ends, its fingerprints are packed into sorted
+arrays of 64-bit digests and counts, which take 12 bytes per transaction.
+"""
+
+import hashlib
+import logging
+import struct
+
+from collections import namedtuple
+
+import numpy
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# The fingerprints of an earlier file.
+#   first: The date of the earliest transaction of the file.
+#   last: The date of the latest transaction of the file.
+#   fingerprints: A sorted array of the distinct fingerprints of the file.
+#   counts: An array of the occurrences of each of the fingerprints.
+FileFingerprints = namedtuple(
+    'FileFingerprints',
+    'first last fingerprints counts')
+
+
+def Fingerprint(tx):
+  """Returns a compact digest of the fields identifying |tx|, as an integer."""
+  key = (tx.date, tx.settlement_date, tx.symbol, tx.type, tx.units,
+         tx.value, tx.fees)
+  return struct.unpack('<Q', hashlib.sha1(repr(key)).digest()[:8])[0]
+
+
+class Deduplicator(object):
+  """Drops the transactions of a file that earlier files already had."""
+
+  def __init__(self):
+    # The FileFingerprints of each file seen so far.
+    self.files = []
+    self.dropped = 0
+    self._seen = None
+    self._range = None
+    self._dropped_before = 0
+
+  def _Accepted(self, date, f):
+    """Returns the most occurrences of the fingerprint |f| in any earlier file
+    covering |date|.
+    """
+    f = numpy.uint64(f)
+    count = 0
+    for first, last, fingerprints, counts in self.files:
+      if first <= date <= last:
+        i = numpy.searchsorted(fingerprints, f)
+        if i < len(fingerprints) and fingerprints[i] == f:
+          count = max(count, counts[i])
+    return count
+
+  def Begin(self, func):
+    """Starts a file, returning a filter that emits its new transactions.
+
+    Args:
+      func: A function that will receive each transaction not seen in an
+            earlier file.
+    """
+    self._seen = {}
+    self._range = None
+    self._dropped_before = self.dropped
+
+    def Filter(tx):
+      if self._range is None:
+        self._range = (tx.date, tx.date)
+      else:
+        self._range = (min(self._range[0], tx.date),
+                       max(self._range[1], tx.date))
+      # The date is part of the fingerprint, so the fingerprints of a file
+      # need not be grouped by date.
+      f = Fingerprint(tx)
+      self._seen[f] = self._seen.get(f, 0) + 1
+      if self._seen[f] <= self._Accepted(tx.date, f):
+        self.dropped += 1
+        return
+      func(tx)
+
+    return Filter
+
+  def End(self, path):
+    """Ends the file at |path|, recording its fingerprints."""
+    if self._range is not None:
+      fingerprints = numpy.array(sorted(self._seen.iterkeys()),
+                                 dtype=numpy.uint64)
+      counts = numpy.array([self._seen[f] for f in fingerprints.tolist()],
+                           dtype=numpy.uint32)
+      self.files.append(FileFingerprints(self._range[0], self._range[1],
+                                         fingerprints, counts))
+    dropped = self.dropped - self._dropped_before
+    if dropped > 0:
+      LOGGER.warning('Dropped %d transactions of "%s" already seen in '
+                     'other files.', dropped, path)
+    self._seen = None
+    self._range = None
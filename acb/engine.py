@@ -0,0 +1,697 @@
+#!/usr/bin/env python
+"""The engine for calculating ACB and capital gains/losses for stock market
+trades.
+"""
+
+import copy
+import datetime
+import logging
+
+import numpy
+
+import acb.common
+import acb.currency
+import acb.lots
+
+from collections import namedtuple
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Adjusted cost base. This is implicitly in CAD.
+AdjustedCostBase = namedtuple(
+    'AdjustedCostBase',
+    'units cost')
+
+
+# A special kind of transaction that will invoke a functor. The function is
+# called as function(date, acbs, cgs, shares, when, currency), and updates in
+# place any of the per-symbol ACBs, the capital gains per year and the
+# per-symbol stacks of purchases it is given. Amounts are converted under the
+# rate policy |when|, and the ACBs are in |currency|. The function is also
+# called with empty dicts for whichever of these are not being updated.
+TransactionFunctor = namedtuple(
+    'TransactionFunctor',
+    'date settlement_date function')
+
+
+# TODO: Handle capital gains/losses here as well.
+def GoogleSplit(date, acbs, cg, shares, when, currency):
+  """Applies the stock split to ACBs and capital gains/losses.
+
+  The ACBs in |acbs| are amounts in |currency|.
+  """
+  if 'GOOG' in acbs:
+    a = acbs['GOOG']
+    cost_per_share = acb.common.CurrencyAmount('USD', 0.001)
+    cost_per_share = acb.currency.Convert(
+        cost_per_share, currency, date, when)
+    # Class A GOOG shares become Class A GOOGL shares, and retain their
+    # original cost base.
+    acbs['GOOGL'] = a
+    # One GOOG class C share is awarded per Class A GOOG share. These are
+    # a dividend with a par value of USD 0.001.
+    acbs['GOOG'] = AdjustedCostBase(
+        a.units, a.units * cost_per_share.amount)
+
+  # TODO: Handle the capital gains of the dividend!
+
+  # Issue GOOGL shares.
+  if 'GOOG' in shares:
+    # Create a clone of the list so that modifying one doesn't affect
+    # the other.
+    shares['GOOGL'] = copy.deepcopy(shares['GOOG'])
+
+
+def PushShares(shares, units, value, date):
+  """Pushes shares to a stack of purchases."""
+  if len(shares) == 0 or shares[-1][0] != date:
+    shares.append([date, units, value])
+    return
+  shares[-1][1] += units
+  shares[-1][2] += units * value
+
+
+def PopShares(shares, units, count_since):
+  """Pops shares from a stack of purchases.
+  
+  Returns the number and value of shares that covered the sale that had been
+  acquired >= |count_since|.
+  """
+  net_units = 0
+  net_value = 0
+  buy_date = None
+
+  # Pop off old batches of shares until the last batch is big
+  # enough to cover the remaining sale.
+  while shares[-1][1] < units:
+    units -= shares[-1][1]
+    buy_date = shares[-1][0]
+    if shares[-1][0] >= count_since:
+      net_units += shares[-1][1]
+      net_value += shares[-1][2]
+    del shares[-1]
+
+  # At this point the current acquisition will cover the sale.
+  # Remove the shares and return the date.
+  new_units = shares[-1][1] - units
+  new_value = shares[-1][2] * new_units / shares[-1][1]
+  delta_value = shares[-1][2] - new_value
+  buy_date = shares[-1][0]
+  shares[-1][1] = new_units
+  shares[-1][2] = new_value
+  if shares[-1][0] >= count_since:
+    net_units += units
+    net_value += delta_value
+  if shares[-1][1] == 0:
+    del shares[-1]
+  return (buy_date, net_units, net_value)
+
+
+def SumShares(shares):
+  """Sums the shares in a stack of purchases."""
+  net = 0
+  for (date, units) in shares:
+    net += units
+  return net
+
+
+DEFAULT_RATE = 'daily noon'
+
+
+# The events reported to listeners by ProcessTransactions. All amounts are in
+# CAD, and |acb| is the AdjustedCostBase of the property after the event.
+#   transaction: The Transaction that caused the event.
+#   date: The settlement date of the event.
+#   symbol: The property involved.
+Acquisition = namedtuple(
+    'Acquisition',
+    'transaction date symbol units cost fees acb')
+
+# |cost| is the ACB of the units disposed of, and |expenses| the fees. The
+# |acquisition| is the date of the last lot covering the sale, and the
+# |washed_units| and |washed_value| those acquired within the preceding 30
+# days. |matches| maps each additional lot matching policy to the list of
+# acb.lots.MatchedLot covering the sale under that policy.
+Disposition = namedtuple(
+    'Disposition',
+    'transaction date symbol units proceeds cost expenses gain acquisition '
+    'washed_units washed_value acb matches')
+
+CapitalReturn = namedtuple(
+    'CapitalReturn',
+    'transaction date symbol value acb')
+
+Fee = namedtuple(
+    'Fee',
+    'transaction date symbol value')
+
+# |functor| is the TransactionFunctor that was applied, and |acbs| a copy of
+# the AdjustedCostBase of every property after it was applied.
+CorporateAction = namedtuple(
+    'CorporateAction',
+    'functor date acbs')
+
+
+class Listener(object):
+  """Receives the events of a ProcessTransactions run.
+
+  Subclasses override the events they are interested in. Events are only
+  built when at least one listener is provided.
+  """
+
+  def OnAcquisition(self, event):
+    pass
+
+  def OnDisposition(self, event):
+    pass
+
+  def OnCapitalReturn(self, event):
+    pass
+
+  def OnFee(self, event):
+    pass
+
+  def OnCorporateAction(self, event):
+    pass
+
+  def OnYearEnd(self, year):
+    """Called once the events of |year| are all reported."""
+    pass
+
+
+class CapitalGainsReport(Listener):
+  """Collects capital gains/loss events for reporting."""
+
+  def __init__(self):
+    # An event is a capital gains/loss generating sale. Multiple events that
+    # occur for the same property type on the same day can be folded.
+    self.events = {}
+
+  def OnDisposition(self, event):
+    if numpy.all(event.gain == 0):
+      return
+
+    # Ensure there's an event for this day and property.
+    date = event.date
+    if date not in self.events:
+      self.events[date] = {}
+    if event.symbol not in self.events[date]:
+      self.events[date][event.symbol] = {
+        'units': 0,
+        'acquisition': event.acquisition,
+        'proceeds': 0,
+        'acb': 0,
+        'expenses': 0,
+        'lots': 0,
+      }
+
+    # Get the existing event.
+    evt = self.events[date][event.symbol]
+    evt['units'] += event.units
+    evt['acquisition'] = max(evt['acquisition'], event.acquisition)
+    evt['proceeds'] += event.proceeds
+    evt['acb'] += event.cost
+    evt['expenses'] += event.expenses
+    evt['lots'] += 1
+
+  def SelectRatePolicy(self, index):
+    """Returns the report under one of several rate policies.
+
+    See ProcessTransactions for details.
+    """
+    report = CapitalGainsReport()
+    for date, props in self.events.iteritems():
+      report.events[date] = {}
+      for prop, evt in props.iteritems():
+        evt = dict(evt)
+        for k in ('proceeds', 'acb', 'expenses'):
+          evt[k] = _Select(evt[k], index)
+        report.events[date][prop] = evt
+    return report
+
+  def PrintEvents(self):
+    """Prints the individual capital gains/loss events."""
+    events = self.events
+    for date in sorted(events.keys()):
+      for prop in sorted(events[date].keys()):
+        evt = events[date][prop]
+        print 'Capital Gains/Loss Event'
+        print 'Property   : %s' % prop
+        print 'Units      : %.2f' % evt['units']
+        print 'Acquisition: %s' % evt['acquisition'].strftime('%d-%m-%Y')
+        print 'Settlement : %s' % date.strftime('%d-%m-%Y')
+        print 'Proceeds   : $%.2f' % evt['proceeds']
+        print 'ACB        : $%.2f' % evt['acb']
+        print 'ACB/unit   : $%.2f' % (evt['acb'] / evt['units'])
+        print 'Expenses   : $%.2f' % evt['expenses']
+        print 'Lots       : %d' % evt['lots']
+        print ''
+
+  def RollUp(self):
+    """Rolls up events by year and property symbol."""
+    events = self.events
+    years = {}
+    for date in sorted(events.keys()):
+      y = date.year
+      if y not in years:
+        years[y] = {}
+      props = years[y]
+
+      for prop in sorted(events[date].keys()):
+        evt = events[date][prop]
+
+        if prop not in props:
+          props[prop] = copy.deepcopy(evt)
+          props[prop]['transactions'] = 1
+          props[prop]['date'] = date
+          del props[prop]['acquisition']
+          del props[prop]['lots']
+        else:
+          net = props[prop]
+          net['units'] += evt['units']
+          net['proceeds'] += evt['proceeds']
+          net['acb'] += evt['acb']
+          net['expenses'] += evt['expenses']
+          net['transactions'] += 1
+          net['date'] = max(net['date'], date)
+    return years
+
+  def PrintAnnualized(self):
+    """Prints an annualized list of capital gains events."""
+    years = self.RollUp()
+    for year in sorted(years.keys()):
+      print 'Annualized Capital Gain/Loss Events For %d\n' % year
+      props = years[year]
+      for prop in sorted(props.keys()):
+        evt = props[prop]
+        g = evt['proceeds'] - evt['acb'] - evt['expenses']
+        print 'Property    : %s' % prop
+        print 'Units       : %.2f' % evt['units']
+        print 'Proceeds    : $%.2f' % evt['proceeds']
+        print 'ACB         : $%.2f' % evt['acb']
+        print 'Expenses    : $%.2f' % evt['expenses']
+        print 'Transactions: %d' % evt['transactions']
+        print 'Gains       : $%.2f' % g
+        print 'Date        : %s' % evt['date'].strftime('%Y-%m-%d')
+        print ''
+
+
+def _Max0(x):
+  """Returns max(0, x), elementwise if |x| is an array."""
+  if isinstance(x, numpy.ndarray):
+    return numpy.maximum(x, 0)
+  return max(0, x)
+
+
+def _Select(x, index):
+  """Returns element |index| of |x| if it is an array, otherwise |x|."""
+  if isinstance(x, numpy.ndarray):
+    return float(x[index])
+  return x
+
+
+def ProcessTransactions(txs, display=False, listeners=(), rate=DEFAULT_RATE,
+                        lot_policies=(), spill=None, currencies=()):
+  """Process the list of transactions, using the provided conversion rates.
+
+  Args:
+    txs: The sorted list of transactions and transaction functors.
+    display: If True, prints the annualized capital gains/loss events.
+    listeners: Listeners to be notified of each event.
+    rate: The rate policy used for currency conversions, from
+          acb.currency.BOC_WHENS. This may also be a tuple of rate policies,
+          which are all evaluated in the same pass. Every CAD amount in the
+          results and events is then an array with one value per policy, and
+          SelectRatePolicy separates the results of each.
+    lot_policies: Names of lot matching policies from acb.lots.POLICIES.
+                  Lots are additionally tracked under each policy, and the
+                  lots matched by each disposition are reported to listeners.
+    spill: An optional acb.spill.YearStore. The totals of each year, and the
+           events of the displayed report, are then written to it once the
+           transactions pass the end of the year, and dropped from memory.
+    currencies: Reporting currencies in which to additionally track the ACB
+                of each property. These ACBs don't reflect transaction fees,
+                but rather only the acquisition costs, converted at the daily
+                noon rate of each transaction.
+
+  Returns:
+    A tuple of the ACBs by symbol, the ACBs by reporting currency and symbol,
+    the capital gains by year, the stacks of purchases by symbol and the
+    carrying costs by year.
+  """
+  acbs = {}
+  cgs = {}
+  shares = {}
+
+  # ACBs in each reporting currency, and the rates from the currency of each
+  # transaction to each of them.
+  acbs2 = dict((currency, {}) for currency in currencies)
+  rates2 = _ReportingRates(txs, currencies)
+
+  # Lots tracked under additional matching policies, by policy and symbol.
+  lots = dict((p, {}) for p in lot_policies)
+
+  listeners = list(listeners)
+  report = None
+  if display:
+    report = spill.Report() if spill is not None else CapitalGainsReport()
+    listeners.append(report)
+
+  # Fees are simply accumulated in a calendar year.
+  carrying_costs = {}
+
+  # The year of the transactions being processed.
+  year = None
+  
+  for i, tx in enumerate(txs):
+    date = tx.settlement_date
+
+    # Finalize the years that the transactions have passed.
+    if year is not None and date.year > year:
+      _EndYear(year, cgs, carrying_costs, listeners, spill)
+    year = date.year
+
+    # Handle transaction functors.
+    if type(tx) == TransactionFunctor:
+      tx.function(date, acbs, cgs, shares, rate, 'CAD')
+      # The lots of each policy are kept like |shares|, so apply the functor
+      # to them as well.
+      for p in lots:
+        tx.function(date, {}, {}, lots[p], rate, 'CAD')
+      # So do the ACBs in each reporting currency, which are converted at the
+      # daily noon rate.
+      for currency, table in acbs2.iteritems():
+        tx.function(date, table, {}, {}, DEFAULT_RATE, currency)
+      if listeners:
+        event = CorporateAction(tx, date, dict(acbs))
+        for l in listeners:
+          l.OnCorporateAction(event)
+      continue
+
+    # Get the fees in our local currency.
+    fees = acb.currency.Convert(
+        tx.fees, 'CAD', date, rate)
+    
+    # Ensure there's an ACB entry for this symbol.
+    a = acbs.get(tx.symbol, AdjustedCostBase(0.0, 0.0))
+    
+    # Ensure there's a capital gains entry for this year.
+    y = date.year
+    if y not in cgs:
+      cgs[y] = 0.0
+  
+    # Ensure there's a shares stack for this year.
+    if tx.symbol not in shares:
+      shares[tx.symbol] = []
+
+    if (tx.type == acb.common.TRANS_ACQUIRE or
+        tx.type == acb.common.TRANS_BUY):
+      # TODO: Handle buys within 30 days of an equivalent sale. The losses
+      # from the corresponding sale have to be ignored and instead pushed
+      # into the ACB.
+      value = acb.currency.Convert(
+          tx.value, 'CAD', date, rate)
+      a = AdjustedCostBase(
+          a.units + tx.units,
+          a.cost + tx.units * value.amount + fees.amount)
+      PushShares(shares[tx.symbol], tx.units, tx.units * value.amount, date)
+      for p in lots:
+        if tx.symbol not in lots[p]:
+          lots[p][tx.symbol] = acb.lots.POLICIES[p]()
+        lots[p][tx.symbol].Push(date, tx.units, tx.units * value.amount)
+
+      if listeners:
+        event = Acquisition(tx, date, tx.symbol, tx.units,
+                            tx.units * value.amount, fees.amount, a)
+        for l in listeners:
+          l.OnAcquisition(event)
+    elif tx.type == acb.common.TRANS_SELL:
+      (buy_date, washed_units, washed_value) = PopShares(
+          shares[tx.symbol], tx.units, date - datetime.timedelta(days=30))
+
+      # TODO(chrisha): Optionally wash sales against the most recent
+      # purchases.
+
+      matches = dict((p, lots[p][tx.symbol].Pop(tx.units)) for p in lots)
+
+      value = acb.currency.Convert(
+          tx.value, 'CAD', date, rate)
+      cost_per_unit = a.cost / a.units
+      units = _Max0(a.units - tx.units)
+      cost = _Max0(a.cost * units / a.units)
+      
+      # Update the ACB.
+      a = AdjustedCostBase(units, cost)
+      
+      # Calculate capital gains or losses.
+      cg = (value.amount - cost_per_unit) * tx.units - fees.amount
+        
+      cgs[y] += cg
+
+      if listeners:
+        event = Disposition(tx, date, tx.symbol, tx.units,
+                            value.amount * tx.units, cost_per_unit * tx.units,
+                            fees.amount, cg, buy_date, washed_units,
+                            washed_value, a, matches)
+        for l in listeners:
+          l.OnDisposition(event)
+    elif tx.type == acb.common.TRANS_CAPITAL_RETURN:
+      # Simply decrease the adjusted cost base by the amount of the capital
+      # return.
+      value = acb.currency.Convert(
+          tx.value, 'CAD', date, rate)
+      a = acbs[tx.symbol]
+      cost = _Max0(a.cost - value.amount)
+      a = AdjustedCostBase(a.units, cost)
+
+      if listeners:
+        event = CapitalReturn(tx, date, tx.symbol, value.amount, a)
+        for l in listeners:
+          l.OnCapitalReturn(event)
+    elif tx.type == acb.common.TRANS_DIVIDEND:
+      # TODO(chrisha): Handle dividends properly. Banks actually issue
+      # T3s for this, so not entirely necessary.
+      continue
+    elif tx.type == acb.common.TRANS_FEE:
+      cad = acb.currency.Convert(tx.value, 'CAD', date, rate)
+      y = date.year
+      if y not in carrying_costs:
+        carrying_costs[y] = 0.0
+      carrying_costs[y] += cad.amount
+
+      if listeners:
+        event = Fee(tx, date, tx.symbol, cad.amount)
+        for l in listeners:
+          l.OnFee(event)
+    else:
+      raise Exception('Unknown transaction type: %s' % tx.type)
+
+    acbs[tx.symbol] = a
+    if acbs2:
+      _UpdateReportingAcbs(acbs2, tx, rates2, i)
+
+  if spill is not None:
+    # Assemble the totals of every year, including the last one.
+    cgs.update(spill.GetTotals('capital_gains'))
+    carrying_costs.update(spill.GetTotals('carrying_costs'))
+
+  if report is not None:
+    if isinstance(rate, tuple):
+      for i, policy in enumerate(rate):
+        print 'Capital Gain/Loss Events Using The %s Rate\n' % policy.title()
+        report.SelectRatePolicy(i).PrintAnnualized()
+    else:
+      report.PrintAnnualized()
+
+  # Return the summarys status after processing the shares.
+  return (acbs, acbs2, cgs, shares, carrying_costs)
+
+
+def _ReportingRates(txs, currencies):
+  """Returns the daily noon rates from the currency of each of |txs| to each
+  of |currencies|.
+
+  The rates of all the transactions in a currency are retrieved at once.
+
+  Returns:
+    A dict of currencies to arrays of rates, indexed like |txs|.
+  """
+  if not currencies:
+    return {}
+  by_currency = {}
+  for i, tx in enumerate(txs):
+    if type(tx) != TransactionFunctor:
+      by_currency.setdefault(tx.value.currency, []).append(i)
+  rates = dict((currency, numpy.ones(len(txs))) for currency in currencies)
+  for currency_from, indices in by_currency.iteritems():
+    days = numpy.array([txs[i].settlement_date.strftime('%Y-%m-%d')
+                        for i in indices], dtype='datetime64[D]')
+    for currency in currencies:
+      rates[currency][indices] = acb.currency.GetDailyNoonRates(
+          currency_from, currency, days)
+  return rates
+
+
+def _UpdateReportingAcbs(acbs2, tx, rates2, i):
+  """Updates the ACBs in each reporting currency for |tx|, the |i|th
+  transaction.
+  """
+  for currency, table in acbs2.iteritems():
+    a2 = table.get(tx.symbol, AdjustedCostBase(0.0, 0.0))
+    if (tx.type == acb.common.TRANS_ACQUIRE or
+        tx.type == acb.common.TRANS_BUY):
+      a2 = AdjustedCostBase(
+          a2.units + tx.units,
+          a2.cost + tx.units * tx.value.amount * rates2[currency][i])
+    elif tx.type == acb.common.TRANS_SELL:
+      if a2.units <= 0:
+        continue
+      units = _Max0(a2.units - tx.units)
+      a2 = AdjustedCostBase(units, _Max0(a2.cost * units / a2.units))
+    elif tx.type == acb.common.TRANS_CAPITAL_RETURN:
+      a2 = AdjustedCostBase(
+          a2.units,
+          _Max0(a2.cost - tx.value.amount * rates2[currency][i]))
+    else:
+      continue
+    table[tx.symbol] = a2
+
+
+def _EndYear(year, cgs, carrying_costs, listeners, spill):
+  """Finalizes |year|, spilling its totals to |spill| if given."""
+  for l in listeners:
+    l.OnYearEnd(year)
+  if spill is None:
+    return
+  totals = {}
+  if year in cgs:
+    totals['capital_gains'] = cgs.pop(year)
+  if year in carrying_costs:
+    totals['carrying_costs'] = carrying_costs.pop(year)
+  if totals:
+    spill.AddTotals(year, totals)
+
+
+def SelectRatePolicy(results, index):
+  """Returns the results of ProcessTransactions under one of several rate
+  policies.
+
+  Args:
+    results: The results of ProcessTransactions, evaluated under a tuple of
+             rate policies.
+    index: The index of the rate policy in the tuple.
+  """
+  acbs, acbs2, cgs, shares, carrying_costs = results
+  acbs = dict((sym, AdjustedCostBase(a.units, _Select(a.cost, index)))
+              for sym, a in acbs.iteritems())
+  cgs = dict((y, _Select(cg, index)) for y, cg in cgs.iteritems())
+  shares = dict((sym, [[d, u, _Select(v, index)] for d, u, v in lots])
+                for sym, lots in shares.iteritems())
+  carrying_costs = dict((y, _Select(cc, index))
+                        for y, cc in carrying_costs.iteritems())
+  return (acbs, acbs2, cgs, shares, carrying_costs)
+
+
+GOOGLE_SPLIT_DATE = datetime.datetime(year=2014, month=4, day=2)
+
+# The corporate actions applied to every history.
+CORPORATE_ACTIONS = [
+    TransactionFunctor(date=GOOGLE_SPLIT_DATE,
+                       settlement_date=GOOGLE_SPLIT_DATE,
+                       function=GoogleSplit),
+]
+
+
+# The symbols whose history is needed to process each symbol. GOOGL shares
+# were issued from GOOG shares by the split.
+SYMBOL_DEPENDENCIES = {
+  'GOOGL': ('GOOG',),
+}
+
+
+def ExpandSymbols(symbols):
+  """Returns |symbols| with the symbols their history depends on."""
+  expanded = set(symbols)
+  for sym in list(expanded):
+    expanded.update(SYMBOL_DEPENDENCIES.get(sym, ()))
+  return expanded
+
+
+def PrepareTransactions(txs, last_year=None):
+  """Returns |txs| with the corporate actions added, sorted for processing.
+
+  If |last_year| is given, corporate actions after that year are left out.
+  """
+  actions = CORPORATE_ACTIONS
+  if last_year is not None:
+    actions = [a for a in actions if a.settlement_date.year <= last_year]
+  # TODO: Process buys and sells on the same day such that the
+  # oldest shares are sold first. That is, always process sales first
+  # unless there's insufficient stock to handle the sale. In which case,
+  # process buys until there's just enough.
+  return sorted(list(txs) + actions, acb.common.TransactionComparator)
+
+
+def PrefetchRates(txs, rate=DEFAULT_RATE):
+  """Retrieves the conversion rates needed by |txs| up front, rather than one
+  date at a time.
+
+  Args:
+    txs: The sorted list of transactions and transaction functors.
+    rate: The rate policy, or tuple of rate policies, as in
+          ProcessTransactions.
+  """
+  if len(txs) == 0:
+    return
+  currencies = set()
+  for tx in txs:
+    if type(tx) != TransactionFunctor:
+      currencies.add(tx.value.currency)
+      currencies.add(tx.fees.currency)
+  if not isinstance(rate, tuple):
+    rate = (rate,)
+  for r in rate:
+    acb.currency.PrefetchRates(
+        txs[0].settlement_date, txs[-1].settlement_date, r, currencies)
+
+
+def PrintSummary(acbs, acbs2, cgs, shares, carrying_costs):
+  """Print a summary of the status."""
+  print 'Current Adjusted Cost Bases'
+  for sym in sorted(acbs.keys()):
+    a = acbs[sym]
+    if a.units == 0:
+      continue
+    u = a.cost / a.units
+    line = "%s: units=%d cost=%.2f cost_per_unit=%.2f" % (
+        sym, a.units, a.cost, u)
+    # The cost per unit in each reporting currency.
+    u2 = ['%s %.2f' % (currency, acbs2[currency][sym].cost /
+                       acbs2[currency][sym].units)
+          for currency in sorted(acbs2.iterkeys())
+          if acbs2[currency].get(sym, AdjustedCostBase(0, 0)).units > 0]
+    if u2:
+      line += ' (%s)' % ', '.join(u2)
+    print line
+  print ''
+  
+  print 'Capital Gains Record'
+  total_cg = 0
+  for year in sorted(cgs.keys()):
+    cg = cgs[year]
+    total_cg += cg
+    print "%d: capital_gains=%.2f" % (year, cg)
+  print "sum : capital_gains=%.2f" % (total_cg)
+  print ''
+
+  if len(carrying_costs) > 0:
+    print 'Carrying Costs'
+    total_cc = 0
+    for year in sorted(carrying_costs.keys()):
+      cc = carrying_costs[year]
+      total_cc += cc
+      print "%d: carrying_costs=%.2f" % (year, cc)
+    print "sum : carrying_costs=%.2f" % (total_cc)
+    print ''
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""Year-end tax-loss harvesting recommendations.
+
+Given the end state of the engine and a snapshot of prices, finds the set of
+sales across all properties that brings the net capital gain of the year
+closest to a target, at the lowest cost. Each property contributes a grid of
+candidate quantities, and the candidates are combined by dynamic programming
+over a discretized net gain axis, with every property evaluated as a batch of
+array operations over all the partial sale sets at once.
+
+Losses that would be superficial, because the property was acquired within
+the preceding 30 days or is to be acquired within the following 30 days, are
+never recommended.
+"""
+
+import datetime
+import logging
+
+from collections import namedtuple
+
+import numpy
+
+import acb.currency
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# The largest number of buckets of the discretized net gain axis.
+MAX_BUCKETS = 200000
+
+# A recommended sale, with amounts in CAD.
+Sale = namedtuple(
+    'Sale',
+    'symbol units price proceeds acb gain')
+
+# A recommendation.
+#   sales: A list of Sale.
+#   gain: The net capital gain of the sales.
+#   net_gain: The net capital gain of the year, including the sales.
+#   cost: The cost of making the sales.
+HarvestPlan = namedtuple(
+    'HarvestPlan',
+    'sales gain net_gain cost')
+
+
+def _RecentlyAcquired(shares, date):
+  """Returns the symbols with lots acquired within 30 days before |date|."""
+  since = date - datetime.timedelta(days=30)
+  return set(sym for sym, lots in shares.iteritems()
+             if any(lot[0] >= since for lot in lots))
+
+
+def Recommend(acbs, shares, cgs, prices, date, target=0.0, planned_buys=(),
+              commission=0.0, spread=0.001, steps=10, tolerance=1.0):
+  """Recommends sales reaching a |target| net capital gain for the year.
+
+  Args:
+    acbs: The per-symbol AdjustedCostBase, as returned by ProcessTransactions.
+    shares: The per-symbol stacks of purchases, as returned by
+            ProcessTransactions.
+    cgs: The capital gains per year, as returned by ProcessTransactions.
+    prices: A dict of symbols to their current price, as a CurrencyAmount.
+    date: The settlement date of the sales.
+    target: The desired net capital gain of the year, in CAD.
+    planned_buys: Symbols to be acquired within 30 days after |date|.
+    commission: The commission paid per sale, in CAD.
+    spread: The cost of selling as a fraction of the proceeds.
+    steps: The number of candidate quantities per property, besides none.
+    tolerance: The net gain within which the target is considered reached,
+               in CAD. Amongst the sale sets within the tolerance, the
+               cheapest is recommended.
+
+  Returns:
+    A HarvestPlan.
+  """
+  blocked = _RecentlyAcquired(shares, date) | set(planned_buys)
+  year_gain = cgs.get(date.year, 0.0)
+
+  # Build the grid of candidate quantities, gains and costs per property.
+  candidates = []
+  for sym in sorted(prices.iterkeys()):
+    a = acbs.get(sym)
+    if a is None or a.units <= 0:
+      continue
+    price = acb.currency.Convert(prices[sym], 'CAD', date).amount
+    acb_per_unit = a.cost / a.units
+    units = numpy.unique(numpy.floor(
+        numpy.linspace(0, a.units, steps + 1)))
+    gains = units * (price - acb_per_unit) - numpy.where(
+        units > 0, commission, 0.0)
+    costs = numpy.where(units > 0, commission, 0.0) + spread * units * price
+    if sym in blocked:
+      allowed = gains >= 0
+      units, gains, costs = units[allowed], gains[allowed], costs[allowed]
+    candidates.append((sym, price, acb_per_unit, units, gains, costs))
+  if len(candidates) == 0:
+    return HarvestPlan([], 0.0, year_gain, 0.0)
+  LOGGER.debug('Evaluating sales of %d properties, %d blocked.',
+               len(candidates), len(blocked))
+
+  # Discretize the net gain of the sales.
+  low = sum(c[4].min() for c in candidates)
+  high = sum(c[4].max() for c in candidates)
+  resolution = max(tolerance / 2.0, (high - low) / MAX_BUCKETS, 0.01)
+  buckets = int(numpy.ceil((high - low) / resolution)) + 1
+
+  # cost[b] is the cheapest cost of a sale set with a net gain in bucket b,
+  # and choices[i][b] the candidate of property i in that sale set.
+  cost = numpy.full(buckets, numpy.inf)
+  cost[0] = 0.0
+  choices = []
+  for sym, price, acb_per_unit, units, gains, costs in candidates:
+    # Shift the gains of this property so that its smallest gain is 0, which
+    # keeps every bucket index within the axis.
+    shifts = numpy.round((gains - gains.min()) / resolution).astype(int)
+    new_cost = numpy.full(buckets, numpy.inf)
+    choice = numpy.zeros(buckets, dtype=int)
+    for j in xrange(len(units)):
+      shifted = numpy.full(buckets, numpy.inf)
+      shifted[shifts[j]:] = cost[:buckets - shifts[j]] + costs[j]
+      better = shifted < new_cost
+      new_cost[better] = shifted[better]
+      choice[better] = j
+    cost = new_cost
+    choices.append((choice, shifts))
+
+  # Pick the cheapest sale set within the tolerance of the target, or
+  # failing that the one closest to it.
+  gain = low + numpy.arange(buckets) * resolution
+  distance = numpy.abs(year_gain + gain - target)
+  reachable = numpy.isfinite(cost)
+  within = reachable & (distance <= tolerance)
+  if within.any():
+    b = numpy.flatnonzero(within)[numpy.argmin(cost[within])]
+  else:
+    b = numpy.flatnonzero(reachable)[numpy.argmin(distance[reachable])]
+
+  # Walk back through the choices to recover the sale set.
+  sales = []
+  total_cost = float(cost[b])
+  for (sym, price, acb_per_unit, units, gains, costs), (choice, shifts) in (
+      reversed(zip(candidates, choices))):
+    j = choice[b]
+    b -= shifts[j]
+    if units[j] > 0:
+      sales.append(Sale(sym, units[j], price, units[j] * price,
+                        units[j] * acb_per_unit, gains[j]))
+  sales.reverse()
+  sales_gain = sum(s.gain for s in sales)
+  return HarvestPlan(sales, sales_gain, year_gain + sales_gain, total_cost)
+
+
+def PrintPlan(plan):
+  """Prints the sales of |plan|."""
+  print 'Recommended Sales\n'
+  for s in plan.sales:
+    print '%s: sell %d units at %.2f (proceeds %.2f, acb %.2f, gain %.2f)' % (
+        s.symbol, s.units, s.price, s.proceeds, s.acb, s.gain)
+  print ''
+  print 'Gain of the sales: %.2f' % plan.gain
+  print 'Net gain of the year: %.2f' % plan.net_gain
+  print 'Cost of the sales: %.2f' % plan.cost
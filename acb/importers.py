@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Loading of exported transaction history files with the right importer."""
+
+import logging
+import os
+
+import acb.cibc
+import acb.mssb
+import acb.parallel
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def GetImporter(path):
+  """Returns the importer module for the file at |path|, based on its name."""
+  b = os.path.basename(path)
+  if b.lower().startswith('mssb'):
+    return acb.mssb
+  elif b.lower().startswith('cibc'):
+    return acb.cibc
+  raise Exception('No importer for file: %s' % path)
+
+
+def Load(path, journal, func, deduplicator=None, symbols=None,
+         last_year=None):
+  """Emits the transactions in the file at |path| to |func|, in file order.
+
+  The source of each transaction is set to its (path, line number).
+
+  Args:
+    path: The path of the exported CSV file.
+    journal: The acb.journal.Journal of previously parsed files.
+    func: A function that will receive each transaction.
+    deduplicator: An optional acb.dedupe.Deduplicator, which drops the
+                  transactions already loaded from other files.
+    symbols: If given, only the transactions of these symbols are loaded.
+             The records of other symbols are skipped without being parsed.
+    last_year: If given, only the transactions up to the end of this year are
+               loaded.
+  """
+  if deduplicator is not None:
+    _Load(path, journal, deduplicator.Begin(func), symbols, last_year)
+    deduplicator.End(path)
+  else:
+    _Load(path, journal, func, symbols, last_year)
+
+
+def LoadFiles(paths, journal, deduplicator=None, symbols=None,
+              last_year=None):
+  """Returns the transactions in the files at |paths|.
+
+  The exports list the most recent transactions first, so the transactions
+  are returned in the reverse of the order they were read in, ready for
+  acb.engine.PrepareTransactions. See Load for the arguments.
+  """
+  txs = []
+  for path in paths:
+    Load(path, journal, txs.append, deduplicator, symbols, last_year)
+  if deduplicator is not None:
+    LOGGER.info('Dropped %d of %d transactions as duplicates.',
+                deduplicator.dropped, deduplicator.dropped + len(txs))
+  txs.reverse()
+  return txs
+
+
+def _Load(path, journal, func, symbols, last_year):
+  importer = GetImporter(path)
+  # Very large files are parsed in parallel rather than journaled.
+  if os.path.getsize(path) >= acb.parallel.LARGE_FILE_SIZE:
+    acb.parallel.Process(path, importer, func, symbols=symbols,
+                         last_year=last_year)
+    return
+  for tx in journal.Load(path, importer, symbols, last_year):
+    func(tx._replace(source=(path, tx.source)))
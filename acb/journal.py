@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""A persistent journal of parsed transactions.
+
+Parsed transactions are stored keyed by the content hash of the file they were
+parsed from, so unchanged files are never parsed twice. The last content seen
+at each path is also recorded. When a file has only grown since, only the
+appended records are parsed.
+"""
+
+import csv
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import StringIO
+import zlib
+
+import acb.memo
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# The default location of the journal, alongside the memoization databases.
+DEFAULT_DB_PATH = acb.memo.CachePath('acb.journal.db')
+
+# The version of the stored records. This is to be incremented whenever the
+# transaction format changes, which invalidates all previously parsed files.
+JOURNAL_VERSION = 2
+
+
+def _Hash(content):
+  return hashlib.sha1(content).hexdigest()
+
+
+def _FindHeader(content, header):
+  """Returns the header line of |content| whose first cell is |header|."""
+  for line in StringIO.StringIO(content):
+    row = next(csv.reader([line]), [])
+    if len(row) > 0 and row[0] == header:
+      return line
+  return None
+
+
+def _Parse(content, importer, symbols=None, last_year=None):
+  """Parses all transactions from |content| with |importer|."""
+  txs = []
+  importer.Process(StringIO.StringIO(content), txs.append, symbols, last_year)
+  return txs
+
+
+def _Keep(tx, symbols, last_year):
+  """Returns whether |tx| is of one of |symbols|, up to |last_year|."""
+  return ((symbols is None or tx.symbol in symbols) and
+          (last_year is None or tx.date.year <= last_year))
+
+
+class Journal(object):
+  """An sqlite3 backed journal of parsed transactions."""
+
+  def __init__(self, db_path=DEFAULT_DB_PATH, cache=None):
+    """Opens the journal at |db_path|.
+
+    Parsed files are also kept in memory in |cache|, a dict keyed by content
+    hash, which may be shared between journals.
+    """
+    self.db_path = db_path
+    if cache is None:
+      cache = {}
+    self.cache = cache
+    self.db = acb.memo.Connect(db_path)
+    c = self.db.cursor()
+    c.execute('CREATE TABLE IF NOT EXISTS files ('
+              'hash TEXT PRIMARY KEY, version INTEGER, size INTEGER, '
+              'transactions BLOB)')
+    c.execute('CREATE TABLE IF NOT EXISTS paths ('
+              'path TEXT PRIMARY KEY, hash TEXT)')
+    self.db.commit()
+
+  def _Get(self, h):
+    """Returns the (size, transactions) parsed from content hashing to |h|."""
+    if h in self.cache:
+      return self.cache[h]
+    c = self.db.cursor()
+    c.execute('SELECT size, transactions FROM files WHERE hash=? AND '
+              'version=?', (h, JOURNAL_VERSION))
+    row = c.fetchone()
+    if row is None:
+      return None
+    parsed = row[0], pickle.loads(zlib.decompress(row[1]))
+    self.cache[h] = parsed
+    return parsed
+
+  def _Put(self, path, h, size, txs):
+    self.cache[h] = size, txs
+    blob = zlib.compress(pickle.dumps(txs, pickle.HIGHEST_PROTOCOL))
+    c = self.db.cursor()
+    c.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+              (h, JOURNAL_VERSION, size, sqlite3.Binary(blob)))
+    c.execute('INSERT OR REPLACE INTO paths VALUES (?, ?)', (path, h))
+    self.db.commit()
+
+  def Load(self, path, importer, symbols=None, last_year=None):
+    """Returns the transactions in the file at |path|.
+
+    When filtering a file that is not in the journal, the filters are applied
+    while parsing and the partial results are not journaled.
+
+    Args:
+      path: The path of the exported CSV file.
+      importer: The importer module for the file, such as acb.mssb.
+      symbols: If given, only the transactions of these symbols are returned.
+      last_year: If given, only the transactions up to the end of this year
+                 are returned.
+
+    Returns:
+      The list of transactions, in the order emitted by |importer|.
+    """
+    path = os.path.abspath(path)
+    with open(path, 'rb') as f:
+      content = f.read()
+    h = _Hash(content)
+
+    parsed = self._Get(h)
+    if parsed is not None:
+      LOGGER.debug('Loaded %d transactions of "%s" from the journal.',
+                   len(parsed[1]), path)
+      if symbols is None and last_year is None:
+        return parsed[1]
+      return [tx for tx in parsed[1] if _Keep(tx, symbols, last_year)]
+
+    if symbols is not None or last_year is not None:
+      txs = _Parse(content, importer, symbols, last_year)
+      LOGGER.debug('Parsed %d filtered transactions of "%s".', len(txs), path)
+      return txs
+
+    # If the file has only grown then only parse the appended records, using
+    # the header line of the file to make sense of them.
+    txs = None
+    c = self.db.cursor()
+    c.execute('SELECT hash FROM paths WHERE path=?', (path,))
+    row = c.fetchone()
+    previous = row and self._Get(row[0])
+    if previous is not None:
+      size, previous_txs = previous
+      header = _FindHeader(content[:size], importer.HEADER)
+      if (header is not None and size < len(content) and
+          content[size - 1] == '\n' and _Hash(content[:size]) == row[0]):
+        # The appended records are parsed after a copy of the header line,
+        # so shift their line numbers to those of the whole file.
+        shift = content[:size].count('\n') - 1
+        txs = previous_txs + [
+            tx._replace(source=tx.source + shift)
+            for tx in _Parse(header + content[size:], importer)]
+        LOGGER.debug('Parsed %d appended transactions of "%s".',
+                     len(txs) - len(previous_txs), path)
+
+    if txs is None:
+      txs = _Parse(content, importer)
+      LOGGER.debug('Parsed %d transactions of "%s".', len(txs), path)
+
+    self._Put(path, h, len(content), txs)
+    return txs
+
+  def Close(self):
+    self.db.close()
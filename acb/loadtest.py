@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""A load test of the rate fetching path against a stand-in BOC server.
+
+Starts a local HTTP server imitating the Bank of Canada CSV endpoints used by
+acb.currency, with configurable latency, bank holidays and error rates. Many
+concurrent consumers, as worker processes each running several threads, then
+query conversion rates through acb.currency against it, sharing a fresh cache
+directory. The report covers the requests issued, the cache hit ratio, the
+tail latency of queries and the number of duplicate fetches.
+
+  python -m acb.loadtest --processes 4 --threads 8 --queries 200
+"""
+
+import argparse
+import BaseHTTPServer
+import collections
+import datetime
+import logging
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import urllib2
+import urlparse
+
+# strptime imports _strptime on first use, which can fail when that first use
+# is concurrent in several threads, so import it up front.
+import _strptime
+
+from collections import namedtuple
+
+import numpy
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# The hosts of the Bank of Canada URLs in acb.currency.
+BOC_HOSTS = ('http://www.bankofcanada.ca', 'https://www.bankofcanada.ca')
+
+# The URL constants of acb.currency that are pointed at the stand-in server.
+BOC_URLS = ('BOC_DAILY_RANGE_URL', 'BOC_MONTHLY_URL', 'BOC_NOONS_URL',
+            'BOC_VALET_URL')
+
+# The rates served for one unit of each currency in CAD, before variation.
+BASE_RATES = {
+  'USD': 1.25,
+  'EUR': 1.45,
+  'GBP': 1.70,
+  'JPY': 0.011,
+}
+
+DEFAULT_START = datetime.date(2013, 1, 1)
+DEFAULT_END = datetime.date(2016, 12, 31)
+
+
+# The configuration of the stand-in server.
+#   latency: The mean delay before each response, in seconds.
+#   holiday_rate: The fraction of weekdays that are bank holidays.
+#   error_rate: The fraction of requests failing with a server error.
+#   seed: The seed of the holidays and errors.
+ServerConfig = namedtuple(
+    'ServerConfig',
+    'latency holiday_rate error_rate seed')
+
+# The results of a load test.
+#   queries: The number of rate queries made.
+#   failures: The number of queries that raised.
+#   requests: The number of requests received by the server.
+#   errors: The number of requests failed by the server.
+#   duplicates: The number of requests for a URL already served successfully.
+#   hit_ratio: The fraction of queries served without any request.
+#   latencies: An array of the duration of each query, in seconds.
+LoadReport = namedtuple(
+    'LoadReport',
+    'queries failures requests errors duplicates hit_ratio latencies')
+
+
+def _Rate(currency, day):
+  """Returns the rate served for |currency| on |day|."""
+  return BASE_RATES[currency] * (
+      1.0 + 0.05 * math.sin(day.toordinal() / 37.0))
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Serves BOC-like CSV rates, and records every request."""
+
+  daemon_threads = True
+
+  def __init__(self, config):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+    self.config = config
+    self.lock = threading.Lock()
+    self.random = random.Random(config.seed)
+    self.served = collections.Counter()
+    self.requests = 0
+    self.errors = 0
+    self.duplicates = 0
+
+  @property
+  def url(self):
+    return 'http://127.0.0.1:%d' % self.server_address[1]
+
+  def IsHoliday(self, day):
+    if day.weekday() >= 5:
+      return True
+    # Holidays are a deterministic function of the seed and the day.
+    r = random.Random('%s %s' % (self.config.seed, day.toordinal()))
+    return r.random() < self.config.holiday_rate
+
+  def Record(self, path):
+    """Records a request of |path|, returning whether it is to fail."""
+    with self.lock:
+      self.requests += 1
+      if self.random.random() < self.config.error_rate:
+        self.errors += 1
+        return True
+      if self.served[path] > 0:
+        self.duplicates += 1
+      self.served[path] += 1
+      return False
+
+
+def _Days(start, end):
+  day = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+  end = datetime.datetime.strptime(end, '%Y-%m-%d').date()
+  while day <= end:
+    yield day
+    day += datetime.timedelta(days=1)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Handles the requests of the BOC endpoints used by acb.currency."""
+
+  def do_GET(self):
+    server = self.server
+    if server.config.latency > 0:
+      time.sleep(random.expovariate(1.0 / server.config.latency))
+    if server.Record(self.path):
+      self.send_error(500)
+      return
+    url = urlparse.urlparse(self.path)
+    query = dict(urlparse.parse_qsl(url.query))
+    if url.path.startswith('/valet/observations/'):
+      lines = self._Noons(url.path.split('/')[3][2:5], query['start_date'],
+                          query['end_date'])
+    elif query.get('lP') == 'lookup_monthly_exchange_rates.php':
+      lines = self._Monthly(query['endRange'][:7])
+    elif query.get('se') == '_0101':
+      lines = self._Noons('USD', query['dF'], query['dT'])
+    else:
+      lines = self._Daily(query['dF'], query['dT'])
+    body = '\n'.join(lines) + '\n'
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/csv')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def _Noons(self, currency, start, end):
+    lines = ['Date,%s/CAD' % currency]
+    for day in _Days(start, end):
+      if not self.server.IsHoliday(day):
+        lines.append('%s,%.4f' % (day, _Rate(currency, day)))
+    return lines
+
+  def _Daily(self, start, end):
+    lines = ['Date,Noon,Close,High,Low']
+    for day in _Days(start, end):
+      if self.server.IsHoliday(day):
+        lines.append('%s,Bank holiday,Bank holiday,Bank holiday,'
+                     'Bank holiday' % day)
+      else:
+        r = _Rate('USD', day)
+        lines.append('%s,%.4f,%.4f,%.4f,%.4f' % (
+            day, r, r * 1.001, r * 1.005, r * 0.995))
+    return lines
+
+  def _Monthly(self, month):
+    r = _Rate('USD', datetime.datetime.strptime(month, '%Y-%m').date())
+    return ['Month,Noon,Close,High,Low,90-day noon,90-day close',
+            '%s,%.4f,%.4f,%.4f,%.4f,%.4f,%.4f' % (
+                month, r, r * 1.001, r * 1.02, r * 0.98, r, r * 1.001)]
+
+  def log_message(self, format, *args):
+    pass
+
+
+def _Consume(args):
+  """Queries random conversion rates from several threads.
+
+  Runs in a worker process.
+
+  Returns:
+    A list of (latency, requests, failed) per query.
+  """
+  url, threads, queries, seed, start, end, whens, currencies = args
+  # acb.currency is only imported here, so that the cache directory set up by
+  # Run is the one used.
+  import acb.currency
+  for name in BOC_URLS:
+    value = getattr(acb.currency, name)
+    for host in BOC_HOSTS:
+      value = value.replace(host, url)
+    setattr(acb.currency, name, value)
+
+  # Count the requests issued by each thread.
+  local = threading.local()
+  urlopen = urllib2.urlopen
+  def CountingUrlopen(*a, **kw):
+    local.requests = getattr(local, 'requests', 0) + 1
+    return urlopen(*a, **kw)
+  urllib2.urlopen = CountingUrlopen
+
+  results = []
+  lock = threading.Lock()
+  def Work(i):
+    r = random.Random('%s %s' % (seed, i))
+    span = (end - start).days
+    for _ in xrange(queries):
+      day = start + datetime.timedelta(days=r.randint(0, span))
+      date = datetime.datetime(day.year, day.month, day.day)
+      when = r.choice(whens)
+      currency = 'USD' if when != 'daily noon' else r.choice(currencies)
+      local.requests = 0
+      failed = False
+      t = time.time()
+      try:
+        acb.currency.GetConversionRate(currency, 'CAD', date, when)
+      except Exception:
+        failed = True
+      latency = time.time() - t
+      with lock:
+        results.append((latency, local.requests, failed))
+
+  workers = [threading.Thread(target=Work, args=(i,)) for i in xrange(threads)]
+  for w in workers:
+    w.start()
+  for w in workers:
+    w.join()
+  return results
+
+
+def Run(config, processes=4, threads=8, queries=100, start=DEFAULT_START,
+        end=DEFAULT_END, whens=None, currencies=('USD',)):
+  """Runs a load test against a stand-in server.
+
+  Args:
+    config: The ServerConfig of the stand-in server.
+    processes: The number of consumer processes.
+    threads: The number of consumer threads per process.
+    queries: The number of queries per thread.
+    start: The first date queried.
+    end: The last date queried.
+    whens: The rate policies queried. Defaults to all of them.
+    currencies: The currencies queried for the daily noon rate.
+
+  Returns:
+    A LoadReport.
+
+  Note:
+    The consumers only use a fresh cache directory if acb.currency has not
+    been imported by the calling process.
+  """
+  if whens is None:
+    whens = ('daily noon', 'daily close', 'daily high', 'daily low',
+             'monthly noon', '90-day noon', 'annual')
+  server = StandInServer(config)
+  serving = threading.Thread(target=server.serve_forever)
+  serving.daemon = True
+  serving.start()
+
+  # The consumers share a fresh cache directory, which is picked up when they
+  # import acb.
+  cache_dir = tempfile.mkdtemp(prefix='acb-loadtest-')
+  previous = os.environ.get('ACB_CACHE_DIR')
+  os.environ['ACB_CACHE_DIR'] = cache_dir
+  # Each consumer gets a process of its own, importing acb afresh.
+  pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+  try:
+    args = [(server.url, threads, queries, '%s %d' % (config.seed, i), start,
+             end, tuple(whens), tuple(currencies)) for i in xrange(processes)]
+    results = sum(pool.map(_Consume, args, chunksize=1), [])
+  finally:
+    pool.terminate()
+    pool.join()
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    if previous is None:
+      del os.environ['ACB_CACHE_DIR']
+    else:
+      os.environ['ACB_CACHE_DIR'] = previous
+
+  latencies = numpy.array([r[0] for r in results])
+  hits = sum(1 for r in results if r[1] == 0 and not r[2])
+  return LoadReport(len(results), sum(1 for r in results if r[2]),
+                    server.requests, server.errors, server.duplicates,
+                    float(hits) / max(len(results), 1), latencies)
+
+
+def PrintReport(report):
+  """Prints |report|."""
+  print 'Queries: %d (%d failed)' % (report.queries, report.failures)
+  print 'Requests: %d (%d failed)' % (report.requests, report.errors)
+  print 'Duplicate fetches: %d' % report.duplicates
+  print 'Cache hit ratio: %.3f' % report.hit_ratio
+  if len(report.latencies) > 0:
+    p50, p95, p99 = numpy.percentile(report.latencies, [50, 95, 99])
+    print 'Latency: p50=%.4fs p95=%.4fs p99=%.4fs max=%.4fs' % (
+        p50, p95, p99, report.latencies.max())
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.WARNING)
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--processes', type=int, default=4)
+  parser.add_argument('--threads', type=int, default=8)
+  parser.add_argument('--queries', type=int, default=100,
+                      help='queries per thread (default: %(default)s)')
+  parser.add_argument('--latency', type=float, default=0.05,
+                      help='mean response delay in seconds (default: '
+                           '%(default)s)')
+  parser.add_argument('--holiday-rate', type=float, default=0.03,
+                      help='fraction of weekdays that are bank holidays '
+                           '(default: %(default)s)')
+  parser.add_argument('--error-rate', type=float, default=0.0,
+                      help='fraction of requests that fail (default: '
+                           '%(default)s)')
+  parser.add_argument('--seed', default='acb')
+  parser.add_argument('--currencies', default='USD',
+                      help='comma separated currencies queried for the daily '
+                           'noon rate, from: %s' % ', '.join(
+                               sorted(BASE_RATES)))
+  args = parser.parse_args()
+  config = ServerConfig(args.latency, args.holiday_rate, args.error_rate,
+                        args.seed)
+  PrintReport(Run(config, args.processes, args.threads, args.queries,
+                  currencies=args.currencies.split(',')))
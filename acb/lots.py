@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Stores of acquired lots, matched against dispositions by various policies.
+
+The pooled ACB is what is reported for tax purposes, but matching sales
+against specific lots is useful for analysis. Each store matches a
+disposition in amortized O(1) or O(log n) time.
+"""
+
+import abc
+import collections
+import heapq
+
+from collections import namedtuple
+
+import numpy
+
+
+# A lot, or the part of one, matched against a disposition.
+#   date: The date the lot was acquired.
+#   units: The number of units matched.
+#   value: The acquisition cost of the matched units in CAD, excluding fees.
+MatchedLot = namedtuple(
+    'MatchedLot',
+    'date units value')
+
+
+class Lots(object):
+  """A store of acquired lots of a single property."""
+
+  __metaclass__ = abc.ABCMeta
+
+  def Push(self, date, units, value):
+    """Adds a lot of |units| acquired on |date| at a total cost of |value|.
+
+    Lots without any units are ignored.
+    """
+    if units > 0:
+      self._Add([date, units, value])
+
+  def Pop(self, units):
+    """Removes |units| from the store.
+
+    Returns:
+      A list of MatchedLot, in the order they were matched.
+    """
+    matches = []
+    while units > 0:
+      if self._Empty():
+        raise Exception('Insufficient units to match a disposition.')
+      lot = self._Peek()
+      take = min(units, lot[-2])
+      value = lot[-1] * take / lot[-2]
+      matches.append(MatchedLot(lot[-3], take, value))
+      units -= take
+      if take == lot[-2]:
+        self._Remove()
+      else:
+        lot[-2] -= take
+        lot[-1] -= value
+    return matches
+
+  @abc.abstractmethod
+  def _Add(self, lot):
+    """Adds |lot|, a list of date, units and value."""
+
+  @abc.abstractmethod
+  def _Empty(self):
+    """Returns True if there are no lots left."""
+
+  @abc.abstractmethod
+  def _Peek(self):
+    """Returns the next lot to match, as a list ending in date, units, value."""
+
+  @abc.abstractmethod
+  def _Remove(self):
+    """Removes the next lot to match."""
+
+
+class LifoLots(Lots):
+  """Matches the most recently acquired lots first."""
+
+  def __init__(self):
+    self.lots = []
+
+  def _Add(self, lot):
+    self.lots.append(lot)
+
+  def _Empty(self):
+    return len(self.lots) == 0
+
+  def _Peek(self):
+    return self.lots[-1]
+
+  def _Remove(self):
+    self.lots.pop()
+
+
+class FifoLots(Lots):
+  """Matches the earliest acquired lots first."""
+
+  def __init__(self):
+    self.lots = collections.deque()
+
+  def _Add(self, lot):
+    self.lots.append(lot)
+
+  def _Empty(self):
+    return len(self.lots) == 0
+
+  def _Peek(self):
+    return self.lots[0]
+
+  def _Remove(self):
+    self.lots.popleft()
+
+
+def _UnitCost(units, value):
+  """Returns the cost per unit of a lot.
+
+  When lots are being tracked under several rate policies, the cost under the
+  first policy is used.
+  """
+  if isinstance(value, numpy.ndarray):
+    value = value[0]
+  if units == 0:
+    return 0.0
+  return float(value) / units
+
+
+class _HeapLots(Lots):
+  """Matches lots in order of their cost per unit.
+
+  Entries are lists of (key, sequence, date, units, value). Partially matching
+  a lot leaves its cost per unit, and hence its position, unchanged. Lots of
+  equal cost are matched in the order they were acquired.
+  """
+
+  # The sign applied to the cost per unit, so that the smallest key is
+  # matched first.
+  SIGN = 1
+
+  def __init__(self):
+    self.lots = []
+    self.sequence = 0
+
+  def _Add(self, lot):
+    key = self.SIGN * _UnitCost(lot[1], lot[2])
+    heapq.heappush(self.lots, [key, self.sequence] + lot)
+    self.sequence += 1
+
+  def _Empty(self):
+    return len(self.lots) == 0
+
+  def _Peek(self):
+    return self.lots[0]
+
+  def _Remove(self):
+    heapq.heappop(self.lots)
+
+
+class LowestCostLots(_HeapLots):
+  """Matches the lots with the lowest cost per unit first."""
+  SIGN = 1
+
+
+class HighestCostLots(_HeapLots):
+  """Matches the lots with the highest cost per unit first."""
+  SIGN = -1
+
+
+# The lot matching policies, by name.
+POLICIES = {
+  'lifo': LifoLots,
+  'fifo': FifoLots,
+  'lowest-cost': LowestCostLots,
+  'highest-cost': HighestCostLots,
+}
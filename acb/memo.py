@@ -1,11 +1,22 @@
 #!/usr/bin/env python
-"""Python decorators for memoization."""
+"""Python decorators for memoization.
+
+The persistent caches are safe to share between many concurrent processes on
+the same host. Databases use write-ahead logging so that readers never block,
+writers wait for each other rather than failing, and a value that is missing
+is only evaluated by one process while the others wait for its result.
+"""
 
 import base64
+import errno
+import fcntl
+import hashlib
 import logging
 import os
 import pickle
 import sqlite3
+import struct
+import threading
 
 from functools import wraps
 
@@ -13,6 +24,97 @@ from functools import wraps
 LOGGER = logging.getLogger(__name__)
 
 
+# The directory holding the persistent caches. This may be overridden with the
+# ACB_CACHE_DIR environment variable, for example to share one cache between
+# several checkouts.
+CACHE_DIR = os.environ.get('ACB_CACHE_DIR',
+                           os.path.abspath(os.path.dirname(__file__)))
+
+# How long in seconds to wait for another process to finish writing.
+BUSY_TIMEOUT = 60.0
+
+# The number of distinct keys that can be locked at once. Keys sharing a slot
+# simply serialize their evaluation.
+LOCK_SLOTS = 1 << 16
+
+
+def CachePath(base):
+	"""Returns the path of the persistent cache named |base|."""
+	return os.path.join(CACHE_DIR, base)
+
+
+def Connect(db_path):
+	"""Opens an sqlite3 database for use by concurrent processes."""
+	db = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+	db.execute('PRAGMA journal_mode=WAL')
+	db.execute('PRAGMA synchronous=NORMAL')
+	return db
+
+
+# The key locks of this process, keyed by lock file path and slot. Each value
+# is a list of the thread lock of the slot and its recursion depth.
+_HELD_LOCKS = {}
+# The lock files of this process, keyed by path. Closing any descriptor of a
+# file releases every lock of the process on it, so each file is opened once
+# and stays open for the life of the process.
+_LOCK_FILES = {}
+# The id of the process owning the registries above.
+_LOCKS_PID = [os.getpid()]
+_HELD_LOCKS_LOCK = threading.Lock()
+
+
+def _LockRegistry():
+	"""Returns the held locks and lock files of the current process.
+
+	A forked child inherits neither the locks nor the thread locks of its
+	parent, so it starts with empty registries and reopens the lock files.
+	Must be called with _HELD_LOCKS_LOCK held.
+	"""
+	if _LOCKS_PID[0] != os.getpid():
+		_HELD_LOCKS.clear()
+		_LOCK_FILES.clear()
+		_LOCKS_PID[0] = os.getpid()
+	return _HELD_LOCKS, _LOCK_FILES
+
+
+class KeyLock(object):
+	"""An exclusive lock of |key|, across threads and processes.
+
+	The lock is reentrant within a thread. Processes lock a byte of
+	|lock_path| selected by the hash of |key|, and threads of a process
+	locking the same slot wait for each other on a thread lock.
+	"""
+
+	def __init__(self, lock_path, key):
+		digest = hashlib.sha1(key).digest()
+		self.lock_path = lock_path
+		self.slot = struct.unpack('<I', digest[:4])[0] % LOCK_SLOTS
+
+	def _Held(self):
+		"""Returns the [thread lock, depth] of the slot, and the lock file."""
+		with _HELD_LOCKS_LOCK:
+			held_locks, lock_files = _LockRegistry()
+			held = held_locks.setdefault((self.lock_path, self.slot),
+																	 [threading.RLock(), 0])
+			if self.lock_path not in lock_files:
+				lock_files[self.lock_path] = open(self.lock_path, 'a')
+			return held, lock_files[self.lock_path]
+
+	def __enter__(self):
+		self.held, self.lock_file = self._Held()
+		self.held[0].acquire()
+		self.held[1] += 1
+		if self.held[1] == 1:
+			fcntl.lockf(self.lock_file, fcntl.LOCK_EX, 1, self.slot, os.SEEK_SET)
+		return self
+
+	def __exit__(self, *args):
+		self.held[1] -= 1
+		if self.held[1] == 0:
+			fcntl.lockf(self.lock_file, fcntl.LOCK_UN, 1, self.slot, os.SEEK_SET)
+		self.held[0].release()
+
+
 def memo(func):
 	"""In memory memoization without persistence."""
 	cache = {}
@@ -31,50 +133,67 @@ def memo(func):
 
 
 def memosql(func):
-	"""Persistent memoization to an sqlite3 database."""
-	self_dir = os.path.abspath(os.path.dirname(__file__))
+	"""Persistent memoization to an sqlite3 database.
+
+	The database is opened on first use in each process and thread.
+	"""
 	db_base = func.__module__ + '.' + func.__name__ + '.db'
-	db_path = os.path.join(self_dir, db_base)
+	db_path = CachePath(db_base)
+	lock_path = db_path + '.lock'
 	LOGGER.debug('Memoizing "%s.%s" to database "%s".',
 							 func.__module__, func.__name__, db_path)
-	db = sqlite3.connect(db_path)
 
-	# Create the database table.
-	try:
-		c = db.cursor()
-		c.execute('CREATE TABLE memo (args TEXT, return TEXT)')
+	# The connection of the current thread, and the id of the process that
+	# opened it.
+	connection = threading.local()
+
+	def GetDatabase():
+		if getattr(connection, 'pid', None) == os.getpid():
+			return connection.db
+		db = Connect(db_path)
+		db.execute('CREATE TABLE IF NOT EXISTS memo (args TEXT, return TEXT)')
 		db.commit()
-		LOGGER.debug('Created "memo" table in database "%s".', db_base)
-	except sqlite3.OperationalError:
-		LOGGER.debug('Table "memo" already exists in database "%s".', db_base)
+		connection.db = db
+		connection.pid = os.getpid()
+		setattr(func, '__memosql_db__', db)
+		return db
+
+	def Lookup(db, args_pickle):
+		c = db.cursor()
+		c.execute('SELECT return FROM memo WHERE args=? LIMIT 1', (args_pickle,))
+		return c.fetchone()
 
 	setattr(func, '__memosql_db_path__', db_path)
-	setattr(func, '__memosql_db__', db)
-		
+	setattr(func, '__memosql_db__', None)
+
 	@wraps(func)
 	def wrap(*args):
 		# Get the args as a 32-byte ASCII hex digest.
 		args_pickle = base64.b64encode(pickle.dumps(args))
+		db = GetDatabase()
 	
 		# Query to see if the value is cached.
 		LOGGER.debug('Querying database "%s" for args "%s".', db_base, args)
-		c = db.cursor()
-		c.execute('SELECT return FROM memo WHERE args=? LIMIT 1', (args_pickle,))
-		return_pickle = c.fetchone()
-		if return_pickle != None:
-			return_value = pickle.loads(base64.b64decode(return_pickle[0]))
-			LOGGER.debug('Returning memoized value "%s" from database "%s".',
-									 return_value, db_base)
-			return return_value
-								 
-		# The value does not exist in the database, so evaluate the function
-		# and save it.
-		return_value = func(*args)
-		LOGGER.debug('Saving value "%s" to database "%s".',
+		return_pickle = Lookup(db, args_pickle)
+		if return_pickle == None:
+			# Only one process evaluates a missing value. Any others wait for it
+			# and then find it in the database.
+			with KeyLock(lock_path, args_pickle):
+				return_pickle = Lookup(db, args_pickle)
+				if return_pickle == None:
+					# The value does not exist in the database, so evaluate the
+					# function and save it.
+					return_value = func(*args)
+					LOGGER.debug('Saving value "%s" to database "%s".',
+											 return_value, db_base)
+					return_pickle = base64.b64encode(pickle.dumps(return_value))
+					db.execute('INSERT INTO memo VALUES (?, ?)',
+										 (args_pickle, return_pickle))
+					db.commit()
+					return return_value
+		return_value = pickle.loads(base64.b64decode(return_pickle[0]))
+		LOGGER.debug('Returning memoized value "%s" from database "%s".',
 								 return_value, db_base)
-		return_pickle = base64.b64encode(pickle.dumps(return_value))
-		c.execute('INSERT INTO memo VALUES (?, ?)', (args_pickle, return_pickle))
-		db.commit()
 		return return_value
 
 	return wrap
@@ -83,8 +202,14 @@ def memosql(func):
 def KillDatabase(func):
 	"""Closes and erases the database associated with the wrapped |func|."""
 	LOGGER.info('Closing and erasing "%s".', func.__memosql_db_path__)
-	func.__memosql_db__.close()
-	os.remove(func.__memosql_db_path__)
+	if func.__memosql_db__ is not None:
+		func.__memosql_db__.close()
+	for suffix in ('', '-wal', '-shm', '.lock'):
+		try:
+			os.remove(func.__memosql_db_path__ + suffix)
+		except OSError as e:
+			if e.errno != errno.ENOENT:
+				raise
 	
 
 if __name__ == '__main__':
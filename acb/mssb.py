@@ -11,6 +11,9 @@ import acb.common
 import acb.date
 
 
+# The first cell of the header row.
+HEADER = 'Date'
+
 MSSB_DATE = re.compile('^[01][0-9]/[0123][0-9]/20\d{2}$')
 MSSB_DOLLAR = re.compile('[^0-9.]')
 MSSB_PLAN_TO_NAME = {
@@ -19,7 +22,7 @@ MSSB_PLAN_TO_NAME = {
     'GSU Class C': 'GOOG'}
 
 
-def Process(src, func):
+def Process(src, func, symbols=None, last_year=None):
   """Parses data from a MSSB exported CSV file.
   
   Reads lines from the provided |src| (an IO object), parses records, and emits
@@ -29,12 +32,14 @@ def Process(src, func):
   Args:
     src: An input IO object.
     func: A function that will receive 
+    symbols: If given, only records of these symbols are parsed.
+    last_year: If given, only records up to the end of this year are parsed.
   """
   reader = csv.reader(src)
   
   # Find the header line.
   for row in reader:
-    if len(row) > 0 and row[0] == 'Date':
+    if len(row) > 0 and row[0] == HEADER:
       break
   header = row
 
@@ -43,10 +48,17 @@ def Process(src, func):
     # Continue as long as we encounter valid records.
     if len(row) == 0 or not MSSB_DATE.match(row[0]):
       break
+    if last_year is not None and int(row[0][-4:]) > last_year:
+      continue
     d = {}
     for i in xrange(min(len(header), len(row))):
       if row[i]:
         d[header[i]] = row[i]
+
+    # Skip the records of other symbols before parsing them.
+    if (symbols is not None and
+        MSSB_PLAN_TO_NAME.get(d.get('Plan')) not in symbols):
+      continue
   
     # Parse the transaction date.
     day = datetime.datetime.strptime(d['Date'], '%m/%d/%Y')
@@ -74,7 +86,8 @@ def Process(src, func):
             type=acb.common.TRANS_ACQUIRE,
             units=r,
             value=acb.common.CurrencyAmount('USD', v),
-            fees=acb.common.CurrencyAmount('USD', 0.0))
+            fees=acb.common.CurrencyAmount('USD', 0.0),
+            source=reader.line_num)
         func(t)
       else:
         # Emit a sell transaction for the tax withholding.
@@ -86,7 +99,8 @@ def Process(src, func):
             type=acb.common.TRANS_SELL,
             units=w,
             value=acb.common.CurrencyAmount('USD', v),
-            fees=acb.common.CurrencyAmount('USD', 0.0))
+            fees=acb.common.CurrencyAmount('USD', 0.0),
+            source=reader.line_num)
         func(t)
 
         # Emit a acquisition transaction.
@@ -97,7 +111,8 @@ def Process(src, func):
             type=acb.common.TRANS_ACQUIRE,
             units=u,
             value=acb.common.CurrencyAmount('USD', v),
-            fees=acb.common.CurrencyAmount('USD', 0.0))
+            fees=acb.common.CurrencyAmount('USD', 0.0),
+            source=reader.line_num)
         func(t)
     elif d['Type'] == 'Sale':
       u = int(float(d['Quantity']))
@@ -111,9 +126,12 @@ def Process(src, func):
           type=acb.common.TRANS_SELL,
           units=u,
           value=acb.common.CurrencyAmount('USD', v),
-          fees=acb.common.CurrencyAmount('USD', f))
+          fees=acb.common.CurrencyAmount('USD', f),
+          source=reader.line_num)
       func(t)
     elif d['Type'] == 'Cash in Lieu':
+      # The quantity is the fraction of a share paid out, if given at all.
+      u = float(d.get('Quantity', 0.0))
       v = float(MSSB_DOLLAR.sub('', d['Net Cash Proceeds']))
       t = acb.common.Transaction(
           date=day,
@@ -122,7 +140,8 @@ def Process(src, func):
           type=acb.common.TRANS_CAPITAL_RETURN,
           units=u,
           value=acb.common.CurrencyAmount('USD', v),
-          fees=acb.common.CurrencyAmount('USD', 0.0))
+          fees=acb.common.CurrencyAmount('USD', 0.0),
+          source=reader.line_num)
       func(t)
     elif d['Type'] == 'Stock Dividend':
       # TODO(chrisha): Handle dividends with a new event type!
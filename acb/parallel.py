@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""Parallel parsing of very large exported CSV files.
+
+The file is memory mapped, the header line is located once, and the records
+following it are split at line boundaries into byte ranges. Each range is
+parsed by a worker process with the header prepended, and the results are
+emitted in file order. At most a bounded number of ranges are in flight, so
+memory use does not grow with the size of the file.
+"""
+
+import collections
+import csv
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os
+import StringIO
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# The size of the byte ranges handed to workers.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Files at least this large are parsed in parallel by acb.py.
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+
+
+def _FindRecords(m, header):
+  """Returns the header line, its line number and the offset of the records
+  following it.
+  """
+  offset = 0
+  line_number = 0
+  while offset < len(m):
+    line_number += 1
+    end = m.find('\n', offset)
+    if end < 0:
+      end = len(m) - 1
+    line = m[offset:end + 1]
+    row = next(csv.reader([line]), [])
+    if len(row) > 0 and row[0] == header:
+      return line, line_number, end + 1
+    offset = end + 1
+  raise Exception('Header "%s" not found.' % header)
+
+
+def _SplitRanges(m, start, chunk_size):
+  """Splits |m| from |start| into byte ranges ending at line boundaries."""
+  ranges = []
+  while start < len(m):
+    end = m.find('\n', min(start + chunk_size, len(m)) - 1)
+    if end < 0:
+      end = len(m)
+    else:
+      end += 1
+    ranges.append((start, end))
+    start = end
+  return ranges
+
+
+class _Lines(object):
+  """Iterates the lines of a string, recording whether all were consumed."""
+
+  def __init__(self, data):
+    self.lines = iter(StringIO.StringIO(data))
+    self.exhausted = False
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    try:
+      return next(self.lines)
+    except StopIteration:
+      self.exhausted = True
+      raise
+
+
+def _ParseRange(args):
+  """Parses the records in a byte range of a file.
+
+  Returns:
+    A tuple of the parsed transactions, whether the records continue past the
+    end of the range, and the number of lines in the range. The transactions
+    are numbered from the header line, as line 1, preceding the range.
+  """
+  path, importer_name, header, start, end, symbols, last_year = args
+  importer = __import__(importer_name, fromlist=['Process'])
+  with open(path, 'rb') as f:
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      data = m[start:end]
+    finally:
+      m.close()
+  lines = _Lines(header + data)
+  txs = []
+  importer.Process(lines, txs.append, symbols, last_year)
+  return txs, lines.exhausted, data.count('\n')
+
+
+def Process(path, importer, func, processes=None, chunk_size=CHUNK_SIZE,
+            symbols=None, last_year=None):
+  """Parses the exported CSV file at |path| in parallel.
+
+  Equivalent to |importer|.Process(open(path, 'rb'), func), but with the
+  records parsed by a pool of worker processes. The source of each transaction
+  is set to its (path, line number), as by acb.importers.Load.
+
+  Args:
+    path: The path of the exported CSV file.
+    importer: The importer module for the file, such as acb.cibc.
+    func: A function that will receive each transaction, in file order.
+    processes: The number of worker processes. Defaults to the number of CPUs.
+    chunk_size: The approximate size in bytes of the ranges parsed by each
+                worker.
+    symbols: If given, only records of these symbols are parsed.
+    last_year: If given, only records up to the end of this year are parsed.
+  """
+  with open(path, 'rb') as f:
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      header, header_line, start = _FindRecords(m, importer.HEADER)
+      ranges = _SplitRanges(m, start, chunk_size)
+    finally:
+      m.close()
+  LOGGER.debug('Parsing %d ranges of "%s" in parallel.', len(ranges), path)
+
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  args = iter([(os.path.abspath(path), importer.__name__, header, s, e,
+                symbols, last_year) for s, e in ranges])
+  pool = multiprocessing.Pool(processes)
+  try:
+    # Keep a bounded number of ranges in flight, emitting them in order.
+    pending = collections.deque()
+    for a in itertools.islice(args, 2 * processes):
+      pending.append(pool.apply_async(_ParseRange, (a,)))
+    # The offset from the line numbers within the next range to those within
+    # the file.
+    line = header_line - 1
+    while pending:
+      txs, exhausted, count = pending.popleft().get()
+      for tx in txs:
+        func(tx._replace(source=(path, tx.source + line)))
+      line += count
+      # The records end at the first line the importer does not recognize, so
+      # stop at the first range that was not parsed to its end.
+      if not exhausted:
+        break
+      for a in itertools.islice(args, 1):
+        pending.append(pool.apply_async(_ParseRange, (a,)))
+  finally:
+    pool.terminate()
+    pool.join()
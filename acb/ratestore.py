@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""Persistent storage of daily rate series.
+
+Rates are stored per named series along with a per-year high-water mark, the
+last date for which the series is known to be complete. This allows a partial
+year to be extended with only the missing days, while closed years are never
+fetched again.
+
+Full daily rate tables (noon, close, high and low) are stored separately, one
+row per calendar day. Days without rates of their own, such as weekends and
+bank holidays, are stored as negative entries referring to the banking day
+whose rates they use. TieredDailyRates serves these tables from memory, the
+store and the network in turn.
+
+A recent weekday without rates may only be waiting for them to be published,
+so it is not stored until it is PUBLICATION_DAYS old.
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+
+import numpy
+
+import acb.memo
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# The default location of the rate store, alongside the memoization databases.
+DEFAULT_DB_PATH = acb.memo.CachePath('acb.ratestore.db')
+
+# The number of days after which the rates of a day are certain to have been
+# published, so that a day still without rates is a bank holiday.
+PUBLICATION_DAYS = 7
+
+# How long in seconds to wait before fetching rates again, when the latest
+# days are not published yet.
+REFETCH_SECONDS = 15 * 60
+
+
+def FormatDate(date):
+  """Formats a date as used for keys in the store."""
+  return date.strftime('%Y-%m-%d')
+
+
+def ParseDate(s):
+  """Parses a date key from the store."""
+  return datetime.datetime.strptime(s, '%Y-%m-%d').date()
+
+
+def IsKnownHoliday(day):
+  """Returns True if |day|, having no rates, is certain never to get any.
+
+  That is the case for weekends, and for days old enough that their rates
+  would have been published.
+  """
+  published = datetime.date.today() - datetime.timedelta(days=PUBLICATION_DAYS)
+  return day.weekday() >= 5 or day <= published
+
+
+class RateStore(object):
+  """An sqlite3 backed store of daily rate series.
+
+  The store may be shared by concurrent processes. Fetches of missing rates
+  are to be made while holding Lock, so that they are only made once.
+  """
+
+  def __init__(self, db_path=DEFAULT_DB_PATH):
+    self.db_path = db_path
+    self.pid = os.getpid()
+    LOGGER.debug('Opening rate store "%s".', db_path)
+    self.db = acb.memo.Connect(db_path)
+    c = self.db.cursor()
+    c.execute('CREATE TABLE IF NOT EXISTS rates ('
+              'series TEXT, date TEXT, rate REAL, '
+              'PRIMARY KEY (series, date))')
+    c.execute('CREATE TABLE IF NOT EXISTS coverage ('
+              'series TEXT, year INTEGER, through TEXT, '
+              'PRIMARY KEY (series, year))')
+    c.execute('CREATE TABLE IF NOT EXISTS daily ('
+              'pair TEXT, date TEXT, effective TEXT, '
+              'noon REAL, close REAL, high REAL, low REAL, '
+              'PRIMARY KEY (pair, date))')
+    self.db.commit()
+
+  def GetCoverage(self, series, year):
+    """Returns the last date covered for |series| in |year|, or None."""
+    c = self.db.cursor()
+    c.execute('SELECT through FROM coverage WHERE series=? AND year=?',
+              (series, year))
+    row = c.fetchone()
+    if row is None:
+      return None
+    return ParseDate(row[0])
+
+  def IsClosed(self, series, year):
+    """Returns True if |series| is complete for all of |year|."""
+    through = self.GetCoverage(series, year)
+    return through is not None and through >= datetime.date(year, 12, 31)
+
+  def GetRates(self, series, year):
+    """Returns a dict of date strings to rates of |series| in |year|."""
+    c = self.db.cursor()
+    c.execute('SELECT date, rate FROM rates WHERE series=? AND date>=? AND '
+              'date<=?', (series, '%04d-01-01' % year, '%04d-12-31' % year))
+    return dict(c.fetchall())
+
+  def AddRates(self, series, year, rates, through):
+    """Adds |rates| to |series| and advances the coverage of |year|.
+
+    Args:
+      series: The name of the series.
+      year: The year the rates belong to.
+      rates: A dict of date strings to rates. Existing rates for the same
+             dates are replaced.
+      through: The last date of |year| for which |series| is now complete.
+    """
+    LOGGER.debug('Storing %d rates of "%s" for %d through %s.',
+                 len(rates), series, year, through)
+    c = self.db.cursor()
+    c.executemany('INSERT OR REPLACE INTO rates VALUES (?, ?, ?)',
+                  [(series, d, r) for d, r in rates.iteritems()])
+    c.execute('INSERT OR REPLACE INTO coverage VALUES (?, ?, ?)',
+              (series, year, FormatDate(through)))
+    self.db.commit()
+
+  def GetDaily(self, pair, date):
+    """Returns the daily entry of |pair| for |date|, or None.
+
+    An entry is a tuple of the effective date and a tuple of the (noon, close,
+    high, low) rates. For a day without rates of its own the rates are None,
+    and the effective date is the banking day whose rates it uses.
+    """
+    c = self.db.cursor()
+    c.execute('SELECT effective, noon, close, high, low FROM daily '
+              'WHERE pair=? AND date=?', (pair, FormatDate(date)))
+    row = c.fetchone()
+    if row is None:
+      return None
+    if row[0] != FormatDate(date):
+      return (ParseDate(row[0]), None)
+    return (ParseDate(row[0]), tuple(row[1:]))
+
+  def GetDailyRange(self, pair, start, end):
+    """Returns the banking days of |pair| from |start| to |end| inclusive.
+
+    Returns:
+      A list of (date string, noon, close, high, low) tuples, sorted by date.
+    """
+    c = self.db.cursor()
+    c.execute('SELECT date, noon, close, high, low FROM daily WHERE pair=? '
+              'AND date>=? AND date<=? AND date=effective ORDER BY date',
+              (pair, FormatDate(start), FormatDate(end)))
+    return c.fetchall()
+
+  def CountDaily(self, pair, start, end):
+    """Returns the number of days from |start| to |end| stored for |pair|."""
+    c = self.db.cursor()
+    c.execute('SELECT COUNT(*) FROM daily WHERE pair=? AND date>=? AND date<=?',
+              (pair, FormatDate(start), FormatDate(end)))
+    return c.fetchone()[0]
+
+  def AddDaily(self, pair, entries):
+    """Adds daily entries for |pair|.
+
+    Args:
+      pair: The name of the currency pair.
+      entries: A dict of dates to entries, as returned by GetDaily. Existing
+               entries for the same dates are replaced.
+    """
+    LOGGER.debug('Storing %d daily rate entries of "%s".', len(entries), pair)
+    rows = []
+    for d, (effective, rates) in entries.iteritems():
+      if rates is None:
+        rates = (None, None, None, None)
+      rows.append((pair, FormatDate(d), FormatDate(effective)) + tuple(rates))
+    c = self.db.cursor()
+    c.executemany('INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?, ?, ?)',
+                  rows)
+    self.db.commit()
+
+  def Lock(self, key):
+    """Returns a lock of |key| across all users of the store."""
+    return acb.memo.KeyLock(self.db_path + '.lock', key)
+
+  def Close(self):
+    self.db.close()
+
+
+_DEFAULT_STORE = threading.local()
+
+
+def GetDefaultStore():
+  """Returns the rate store of the current thread, opening it on first use."""
+  store = getattr(_DEFAULT_STORE, 'store', None)
+  if store is None or store.pid != os.getpid():
+    store = RateStore()
+    _DEFAULT_STORE.store = store
+  return store
+
+
+def _Day(date):
+  """Returns |date| as a datetime.date."""
+  return datetime.date(date.year, date.month, date.day)
+
+
+class TieredDailyRates(object):
+  """A read-through provider of the daily rate tables of a currency pair.
+
+  Tables are looked up in memory, then in the rate store, then optionally
+  fetched over the network, and hits are promoted into the faster tiers.
+  Days without rates of their own are cached as negative entries referring to
+  the banking day whose rates they use, so that they never cause another
+  fetch. Recent days that may still get rates are fetched again at most every
+  REFETCH_SECONDS.
+  """
+
+  def __init__(self, pair, fetch=None, lookback_days=7):
+    """Creates a provider.
+
+    Args:
+      pair: The name of the currency pair in the rate store.
+      fetch: A function fetching the rates of banking days from a start to an
+             end date inclusive, as a dict of date strings to lists of (noon,
+             close, high, low) rates. If None then only cached rates are
+             available.
+      lookback_days: The number of days fetched ahead of a range, so that a
+                     range starting on a holiday has a banking day to use.
+    """
+    self.pair = pair
+    self.fetch = fetch
+    self.lookback_days = lookback_days
+    # The in memory tier, of entries by datetime.date.
+    self.memory = {}
+    # The days fetched but not cached, as they may still get rates, by
+    # datetime.date, and the time they were last fetched.
+    self.unpublished = {}
+
+  def _Lookup(self, day):
+    """Returns the cached entry for |day|, or None."""
+    entry = self.memory.get(day)
+    if entry is None:
+      entry = GetDefaultStore().GetDaily(self.pair, day)
+      if entry is not None:
+        self.memory[day] = entry
+    return entry
+
+  def Get(self, date):
+    """Returns the daily rate table for |date|.
+
+    Returns:
+      A list of (date, noon, close, high, low) rates. The date may be earlier
+      than the requested date if the requested day is a bank holiday or a
+      weekend, or if the rates of the requested day are not published yet,
+      in which case all the rates are the closing rate of that earlier
+      banking day.
+    """
+    day = _Day(date)
+    entry = self._Lookup(day)
+    if entry is None:
+      self.Prefetch(day, day)
+      entry = self._Lookup(day)
+      if entry is None and day > datetime.date.today() - datetime.timedelta(
+          days=PUBLICATION_DAYS):
+        # A recent day may still get rates of its own, or follow a day that
+        # may, so use the last banking day without caching it.
+        rows = GetDefaultStore().GetDailyRange(
+            self.pair, day - datetime.timedelta(days=self.lookback_days), day)
+        if rows:
+          entry = (ParseDate(rows[-1][0]), None)
+      if entry is None:
+        raise Exception('Rates not found for %s.' % day)
+
+    effective, rates = entry
+    if rates is None:
+      close = self._Lookup(effective)[1][1]
+      rates = (close, close, close, close)
+    return [datetime.datetime(effective.year, effective.month, effective.day)
+           ] + list(rates)
+
+  def GetRange(self, start, end):
+    """Returns the rates of the banking days from |start| to |end| as arrays.
+
+    Returns:
+      A tuple of an array of datetime64[D] dates, and an array of shape
+      (len(dates), 4) of their (noon, close, high, low) rates.
+    """
+    self.Prefetch(start, end)
+    rows = GetDefaultStore().GetDailyRange(self.pair, _Day(start), _Day(end))
+    dates = numpy.array([r[0] for r in rows], dtype='datetime64[D]')
+    rates = numpy.array([r[1:] for r in rows], dtype=float).reshape(-1, 4)
+    return dates, rates
+
+  def Prefetch(self, start, end):
+    """Caches the daily rate tables of every day from |start| to |end|.
+
+    All of the rates are retrieved in a single request. Days without rates
+    that may yet be published are not cached.
+    """
+    start = _Day(start)
+    end = _Day(end)
+    days = (end - start).days + 1
+    store = GetDefaultStore()
+    if store.CountDaily(self.pair, start, end) + self._Unpublished(
+        start, end) == days:
+      LOGGER.debug('Daily rates from %s to %s are already stored.', start, end)
+      return
+    if self.fetch is None:
+      LOGGER.debug('Daily rates from %s to %s are not available offline.',
+                   start, end)
+      return
+
+    # Another process may be fetching the same rates, so check again once they
+    # are done.
+    with store.Lock(self.pair):
+      if store.CountDaily(self.pair, start, end) + self._Unpublished(
+          start, end) == days:
+        return
+      first = start - datetime.timedelta(days=self.lookback_days)
+      rates = self.fetch(first, end)
+
+      # Walk every day, carrying forward the most recent banking day. A day
+      # that may still get rates is not stored, and neither are the days after
+      # it until the next banking day, which may yet use its rates.
+      now = time.time()
+      entries = {}
+      banking_day = None
+      d = first
+      while d <= end:
+        s = FormatDate(d)
+        if s in rates:
+          banking_day = d
+          entries[d] = (d, tuple(rates[s]))
+        elif banking_day is not None and IsKnownHoliday(d):
+          entries[d] = (banking_day, None)
+        else:
+          banking_day = None
+        if d in entries:
+          self.unpublished.pop(d, None)
+        else:
+          self.unpublished[d] = now
+        d += datetime.timedelta(days=1)
+
+      store.AddDaily(self.pair, entries)
+      self.memory.update(entries)
+
+  def _Unpublished(self, start, end):
+    """Returns the number of days from |start| to |end| recently fetched
+    without rates, which are not fetched again yet.
+    """
+    now = time.time()
+    for d in [d for d, t in self.unpublished.iteritems()
+              if now - t >= REFETCH_SECONDS]:
+      del self.unpublished[d]
+    return sum(1 for d in self.unpublished if start <= d <= end)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""A long-running ACB service with a local HTTP/JSON API.
+
+The service keeps the rate store, memoization caches and parsed journals warm
+between queries, so that only the engine runs for each of them. Requests are
+handled by a bounded pool of worker threads.
+
+  GET /health
+    Returns {"status": "ok"}.
+
+  POST /acb
+    Processes a history of transactions. The request is a JSON object with:
+      transactions: A list of transactions, each with "date",
+                    "settlement_date" (optional, defaults to "date"),
+                    "symbol", "type", "units", and "value" and "fees" as
+                    {"currency": ..., "amount": ...}. Dates are YYYY-MM-DD.
+      files: A list of paths of exported MSSB or CIBC files, relative to the
+             directory given with --files-dir. Files are refused if the
+             service was started without one. Transactions already in an
+             earlier file are dropped.
+      dedupe: Whether to drop transactions already in an earlier file
+              (optional, defaults to true).
+      rate: A rate policy, or a list of them (optional).
+      currencies: A list of currencies in which to also report the ACBs
+                  (optional).
+    Problems with the transactions are reported before any are processed.
+    The response is a JSON object with "acbs", "capital_gains",
+    "carrying_costs" and "report", the annualized capital gains/loss events.
+    If currencies were given, "currency_acbs" maps each to the ACBs in it.
+    If a list of rate policies was given, the response instead maps each
+    policy to such an object.
+"""
+
+import argparse
+import BaseHTTPServer
+import datetime
+import json
+import logging
+import os
+import Queue
+import threading
+
+# The worker threads parse dates, here and in acb.ratestore, and the lazy
+# import of _strptime by the first strptime call is not thread-safe.
+import _strptime
+
+import acb.common
+import acb.currency
+import acb.dedupe
+import acb.engine
+import acb.importers
+import acb.journal
+import acb.validate
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+DEFAULT_PORT = 8321
+DEFAULT_WORKERS = 4
+
+# The number of accepted connections that may wait for a worker.
+QUEUE_SIZE = 64
+
+
+def _ParseDate(s):
+  return datetime.datetime.strptime(s, '%Y-%m-%d')
+
+
+def _ParseAmount(d):
+  return acb.common.CurrencyAmount(d['currency'], float(d['amount']))
+
+
+def TransactionFromJson(d, index=None):
+  """Returns the Transaction described by the JSON object |d|, the |index|th
+  of the request.
+  """
+  date = _ParseDate(d['date'])
+  return acb.common.Transaction(
+      date=date,
+      settlement_date=_ParseDate(d.get('settlement_date', d['date'])),
+      symbol=d['symbol'],
+      type=d['type'],
+      units=d['units'],
+      value=_ParseAmount(d['value']),
+      fees=_ParseAmount(d.get('fees', {'currency': 'CAD', 'amount': 0.0})),
+      source=None if index is None else ('transactions', index))
+
+
+def _AcbsToJson(acbs):
+  return dict((sym, {'units': a.units, 'cost': a.cost})
+              for sym, a in acbs.iteritems())
+
+
+def ResultsToJson(results, report):
+  """Returns the results of ProcessTransactions as a JSON object."""
+  acbs, acbs2, cgs, shares, carrying_costs = results
+  years = report.RollUp()
+  for props in years.itervalues():
+    for evt in props.itervalues():
+      evt['date'] = evt['date'].strftime('%Y-%m-%d')
+      evt['gains'] = evt['proceeds'] - evt['acb'] - evt['expenses']
+  result = {
+    'acbs': _AcbsToJson(acbs),
+    'capital_gains': dict((str(y), cg) for y, cg in cgs.iteritems()),
+    'carrying_costs': dict((str(y), cc)
+                           for y, cc in carrying_costs.iteritems()),
+    'report': dict((str(y), props) for y, props in years.iteritems()),
+  }
+  if acbs2:
+    result['currency_acbs'] = dict(
+        (currency, _AcbsToJson(table)) for currency, table in acbs2.iteritems())
+  return result
+
+
+class Service(object):
+  """The state kept warm between queries."""
+
+  def __init__(self, files_dir=None):
+    """Creates the service, reading exported files only under |files_dir|."""
+    self.files_dir = files_dir and os.path.realpath(files_dir)
+    # Parsed files are shared between the journals of the worker threads.
+    self.parsed = {}
+    self.local = threading.local()
+
+  def GetJournal(self):
+    """Returns the journal of the current thread."""
+    journal = getattr(self.local, 'journal', None)
+    if journal is None:
+      journal = acb.journal.Journal(cache=self.parsed)
+      self.local.journal = journal
+    return journal
+
+  def GetPath(self, path):
+    """Returns the path of the exported file |path| of a request.
+
+    Raises:
+      ValueError: If |path| is not within the files directory.
+    """
+    if self.files_dir is None:
+      raise ValueError('Files are not enabled, see --files-dir.')
+    full_path = os.path.realpath(os.path.join(self.files_dir, path))
+    if not full_path.startswith(os.path.join(self.files_dir, '')):
+      raise ValueError('File is outside of the files directory: %s' % path)
+    return full_path
+
+  def Process(self, request):
+    """Processes a POST /acb request, returning the JSON response."""
+    txs = [TransactionFromJson(d, i)
+           for i, d in enumerate(request.get('transactions', []))]
+    paths = [self.GetPath(path) for path in request.get('files', [])]
+    deduplicator = None
+    if request.get('dedupe', True):
+      deduplicator = acb.dedupe.Deduplicator()
+    txs += acb.importers.LoadFiles(paths, self.GetJournal(), deduplicator)
+    if len(txs) == 0:
+      raise ValueError('No transactions to process.')
+
+    rate = request.get('rate', acb.engine.DEFAULT_RATE)
+    if isinstance(rate, list):
+      rate = tuple(rate)
+    for r in (rate if isinstance(rate, tuple) else (rate,)):
+      if r not in acb.currency.BOC_WHENS:
+        raise ValueError('Unknown rate policy: %s' % r)
+
+    txs = acb.engine.PrepareTransactions(txs)
+    acb.validate.Check(txs)
+    acb.engine.PrefetchRates(txs, rate)
+    report = acb.engine.CapitalGainsReport()
+    results = acb.engine.ProcessTransactions(
+        txs, listeners=[report], rate=rate,
+        currencies=tuple(request.get('currencies', ())))
+
+    if not isinstance(rate, tuple):
+      return ResultsToJson(results, report)
+    return dict((r, ResultsToJson(acb.engine.SelectRatePolicy(results, i),
+                                  report.SelectRatePolicy(i)))
+                for i, r in enumerate(rate))
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Handles the requests of the JSON API."""
+
+  def _Reply(self, code, obj):
+    body = json.dumps(obj, sort_keys=True)
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    if self.path == '/health':
+      self._Reply(200, {'status': 'ok'})
+    else:
+      self._Reply(404, {'error': 'Not found: %s' % self.path})
+
+  def do_POST(self):
+    if self.path != '/acb':
+      self._Reply(404, {'error': 'Not found: %s' % self.path})
+      return
+    try:
+      length = int(self.headers.getheader('Content-Length', 0))
+      request = json.loads(self.rfile.read(length))
+    except ValueError as e:
+      self._Reply(400, {'error': 'Invalid request: %s' % e})
+      return
+    try:
+      self._Reply(200, self.server.service.Process(request))
+    except (KeyError, ValueError) as e:
+      self._Reply(400, {'error': str(e)})
+    except Exception as e:
+      LOGGER.exception('Failed to process request.')
+      self._Reply(500, {'error': str(e)})
+
+  def log_message(self, format, *args):
+    LOGGER.info('%s - %s', self.address_string(), format % args)
+
+
+class PooledHTTPServer(BaseHTTPServer.HTTPServer):
+  """An HTTP server handling requests with a fixed pool of worker threads.
+
+  Accepted connections wait in a bounded queue for a free worker.
+  """
+
+  def __init__(self, address, handler, service, workers=DEFAULT_WORKERS):
+    BaseHTTPServer.HTTPServer.__init__(self, address, handler)
+    self.service = service
+    self.requests = Queue.Queue(QUEUE_SIZE)
+    for i in xrange(workers):
+      t = threading.Thread(target=self._Work, name='acb-worker-%d' % i)
+      t.daemon = True
+      t.start()
+
+  def _Work(self):
+    while True:
+      request, client_address = self.requests.get()
+      try:
+        self.finish_request(request, client_address)
+      except Exception:
+        self.handle_error(request, client_address)
+      finally:
+        self.shutdown_request(request)
+
+  def process_request(self, request, client_address):
+    self.requests.put((request, client_address))
+
+
+def Serve(port=DEFAULT_PORT, workers=DEFAULT_WORKERS, files_dir=None):
+  """Serves the API on localhost until interrupted.
+
+  Requests may only name exported files under |files_dir|.
+  """
+  server = PooledHTTPServer(('127.0.0.1', port), Handler,
+                            Service(files_dir), workers)
+  LOGGER.info('Serving on http://127.0.0.1:%d/ with %d workers.',
+              port, workers)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO)
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+  parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+  parser.add_argument('--files-dir',
+                      help='directory of the exported files that requests '
+                           'may process (default: none)')
+  args = parser.parse_args()
+  Serve(args.port, args.workers, args.files_dir)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""What-if simulation of sales against the end state of the ACB engine."""
+
+import datetime
+import logging
+
+from collections import namedtuple
+
+import numpy
+
+import acb.currency
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# The outcome of a grid of hypothetical sales of a single property. |dates|,
+# |prices| and |quantities| are the axes of the grid. Every other field is an
+# array of shape (len(dates), len(prices), len(quantities)), in CAD, with NaN
+# wherever the quantity exceeds the units held.
+#   proceeds: Gross proceeds of the sale.
+#   acb: The adjusted cost base of the units sold.
+#   fees: The commission paid on the sale.
+#   gains: The capital gain (or loss, if negative) realized by the sale.
+#   washed: Units matched against lots acquired within the 30 days preceding
+#           the sale, which may make a loss superficial.
+#   units: The units held after the sale.
+#   cost: The adjusted cost base of the units held after the sale.
+SaleSimulation = namedtuple(
+    'SaleSimulation',
+    'symbol dates prices quantities proceeds acb fees gains washed units cost')
+
+
+def _GetRates(currency, dates, when):
+  """Returns an array of |currency| -> CAD rates, one per date."""
+  if currency == 'CAD':
+    return numpy.ones(len(dates))
+  return numpy.array([acb.currency.GetConversionRate(currency, 'CAD', d, when)
+                      for d in dates])
+
+
+def _GetWashedUnits(lots, quantities, dates):
+  """Returns the units matched against recently acquired lots.
+
+  Lots are consumed from the top of the stack, as done by PopShares. The
+  result has shape (len(dates), len(quantities)).
+  """
+  if len(lots) == 0:
+    return numpy.zeros((len(dates), len(quantities)))
+
+  # Walk the stack from the top down, computing how many units of each lot
+  # each quantity would consume.
+  lots = lots[::-1]
+  lot_units = numpy.array([l[1] for l in lots], dtype=float)
+  lot_dates = [l[0] for l in lots]
+  consumed_before = numpy.concatenate(([0.0], numpy.cumsum(lot_units)[:-1]))
+  consumed = numpy.clip(
+      quantities[None, :] - consumed_before[:, None], 0, lot_units[:, None])
+
+  # A lot is recent if it was acquired within 30 days of the sale.
+  recent = numpy.array(
+      [[lot_date >= d - datetime.timedelta(days=30) for lot_date in lot_dates]
+       for d in dates], dtype=float)
+  return numpy.dot(recent, consumed)
+
+
+def SimulateSales(acbs, shares, symbol, prices, quantities, dates,
+                  currency='USD', commission=0.0, when='daily noon'):
+  """Simulates selling |symbol| over a grid of prices, quantities and dates.
+
+  Args:
+    acbs: The per-symbol AdjustedCostBase, as returned by ProcessTransactions.
+    shares: The per-symbol stacks of purchases, as returned by
+            ProcessTransactions.
+    symbol: The property to be sold.
+    prices: The per unit sale prices to evaluate, in |currency|.
+    quantities: The numbers of units to evaluate selling.
+    dates: The settlement dates to evaluate.
+    currency: The currency of |prices| and |commission|.
+    commission: The commission paid per sale, in |currency|.
+    when: The time of the exchange, as in acb.currency.Convert.
+
+  Returns:
+    A SaleSimulation.
+  """
+  if symbol not in acbs or acbs[symbol].units == 0:
+    raise Exception('No units of %s are held.' % symbol)
+  a = acbs[symbol]
+  prices = numpy.asarray(prices, dtype=float)
+  quantities = numpy.asarray(quantities, dtype=float)
+  dates = list(dates)
+  LOGGER.debug('Simulating %d sales of %s.',
+               len(dates) * len(prices) * len(quantities), symbol)
+
+  # Only the rates require a lookup per date; everything else is evaluated
+  # over the whole grid at once.
+  rates = _GetRates(currency, dates, when)
+  shape = (len(dates), len(prices), len(quantities))
+  q = numpy.broadcast_to(quantities[None, None, :], shape)
+  proceeds = (prices[None, :, None] * rates[:, None, None]) * q
+  fees = numpy.broadcast_to(commission * rates[:, None, None], shape)
+  sold_acb = q * (a.cost / a.units)
+  gains = proceeds - sold_acb - fees
+  units = a.units - q
+  cost = a.cost * units / a.units
+  washed = numpy.broadcast_to(
+      _GetWashedUnits(shares.get(symbol, []), quantities, dates)[:, None, :],
+      shape)
+
+  # Mask out sales of more units than are held.
+  invalid = q > a.units
+  fields = []
+  for field in (proceeds, sold_acb, fees, gains, washed, units, cost):
+    field = numpy.array(field, dtype=float)
+    field[invalid] = numpy.nan
+    fields.append(field)
+
+  return SaleSimulation(symbol, dates, prices, quantities, *fields)
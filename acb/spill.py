@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""Spilling of finalized years of a ProcessTransactions run to disk.
+
+For very long histories, the capital gains/loss events and yearly totals of
+every year would otherwise stay in memory until the end of the run. Once the
+transaction stream passes the end of a year, its events and totals are written
+to an sqlite3 store and dropped, so that only the open lots, the current ACBs
+and the current year stay resident. Reports are then assembled from the
+store, a year at a time.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import zlib
+
+import acb.engine
+import acb.memo
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _Dumps(obj):
+  return sqlite3.Binary(zlib.compress(pickle.dumps(obj,
+                                                   pickle.HIGHEST_PROTOCOL)))
+
+
+def _Loads(blob):
+  return pickle.loads(zlib.decompress(blob))
+
+
+class YearStore(object):
+  """An sqlite3 backed store of the finalized years of a run.
+
+  Pass it as the |spill| of ProcessTransactions.
+  """
+
+  def __init__(self, db_path):
+    """Opens the store at |db_path|, discarding any previous run in it."""
+    self.db_path = db_path
+    if os.path.exists(db_path):
+      os.remove(db_path)
+    self.db = acb.memo.Connect(db_path)
+    c = self.db.cursor()
+    c.execute('CREATE TABLE events (year INTEGER PRIMARY KEY, events BLOB)')
+    c.execute('CREATE TABLE totals (year INTEGER PRIMARY KEY, totals BLOB)')
+    self.db.commit()
+
+  def AddEvents(self, year, events):
+    """Stores the capital gains/loss events of |year|.
+
+    |events| is a dict as in CapitalGainsReport.events.
+    """
+    LOGGER.debug('Spilling the events of %d days of %d.', len(events), year)
+    self.db.execute('INSERT OR REPLACE INTO events VALUES (?, ?)',
+                    (year, _Dumps(events)))
+    self.db.commit()
+
+  def GetEvents(self, year):
+    """Returns the capital gains/loss events of |year|."""
+    c = self.db.cursor()
+    c.execute('SELECT events FROM events WHERE year=?', (year,))
+    row = c.fetchone()
+    if row is None:
+      return {}
+    return _Loads(row[0])
+
+  def EventYears(self):
+    """Returns the sorted years with stored events."""
+    c = self.db.cursor()
+    c.execute('SELECT year FROM events ORDER BY year')
+    return [row[0] for row in c.fetchall()]
+
+  def AddTotals(self, year, totals):
+    """Stores the totals of |year|, a dict of names to values."""
+    self.db.execute('INSERT OR REPLACE INTO totals VALUES (?, ?)',
+                    (year, _Dumps(totals)))
+    self.db.commit()
+
+  def GetTotals(self, name):
+    """Returns a dict of years to their total |name|, for the years with one."""
+    c = self.db.cursor()
+    c.execute('SELECT year, totals FROM totals ORDER BY year')
+    result = {}
+    for year, blob in c.fetchall():
+      totals = _Loads(blob)
+      if name in totals:
+        result[year] = totals[name]
+    return result
+
+  def Report(self):
+    """Returns a SpillingReport storing its events here."""
+    return SpillingReport(self)
+
+  def Close(self):
+    self.db.close()
+
+
+class SpillingReport(acb.engine.CapitalGainsReport):
+  """A CapitalGainsReport that spills the events of each finalized year."""
+
+  def __init__(self, store, index=None):
+    """Creates a report storing the events of finalized years in |store|.
+
+    If |index| is given, the report is a view of the events under that one of
+    several rate policies.
+    """
+    acb.engine.CapitalGainsReport.__init__(self)
+    self.store = store
+    self.index = index
+
+  def OnYearEnd(self, year):
+    events = dict((date, props) for date, props in self.events.iteritems()
+                  if date.year == year)
+    if events:
+      self.store.AddEvents(year, events)
+    for date in events:
+      del self.events[date]
+
+  def _Years(self):
+    """Yields a report of the events of each year, in order."""
+    years = set(self.store.EventYears())
+    years.update(date.year for date in self.events)
+    for year in sorted(years):
+      report = acb.engine.CapitalGainsReport()
+      report.events = self.store.GetEvents(year)
+      report.events.update((date, props)
+                           for date, props in self.events.iteritems()
+                           if date.year == year)
+      if self.index is not None:
+        report = report.SelectRatePolicy(self.index)
+      yield report
+
+  def SelectRatePolicy(self, index):
+    report = SpillingReport(self.store, index)
+    report.events = self.events
+    return report
+
+  def PrintEvents(self):
+    for report in self._Years():
+      report.PrintEvents()
+
+  def RollUp(self):
+    years = {}
+    for report in self._Years():
+      years.update(report.RollUp())
+    return years
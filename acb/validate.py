@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""Validation of a transaction history before it is processed.
+
+Problems in an exported file otherwise only surface deep inside
+ProcessTransactions, after the conversion rates have been fetched. The checks
+here need neither rates nor ACBs. They run over arrays of the whole history at
+once, and every problem found is reported with the source of its transaction.
+"""
+
+import logging
+
+from collections import namedtuple
+
+import numpy
+
+import acb.common
+import acb.engine
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Units held below this are considered to be none, to allow for rounding.
+EPSILON = 1e-6
+
+# The transaction types understood by the engine.
+KNOWN_TYPES = frozenset([
+    acb.common.TRANS_ACQUIRE,
+    acb.common.TRANS_BUY,
+    acb.common.TRANS_SELL,
+    acb.common.TRANS_CAPITAL_RETURN,
+    acb.common.TRANS_DIVIDEND,
+    acb.common.TRANS_FEE])
+
+
+# A problem with a transaction.
+#   transaction: The offending Transaction.
+#   message: A description of the problem.
+Problem = namedtuple(
+    'Problem',
+    'transaction message')
+
+
+class ValidationError(ValueError):
+  """Raised with the list of problems found in a transaction history."""
+
+  def __init__(self, problems):
+    ValueError.__init__(self, '%d problems found:\n%s' % (
+        len(problems), '\n'.join(FormatProblem(p) for p in problems)))
+    self.problems = problems
+
+
+def FormatSource(tx):
+  """Returns a description of where |tx| was read from."""
+  if isinstance(tx.source, tuple):
+    return '%s:%s' % tx.source
+  if tx.source is not None:
+    return 'line %s' % tx.source
+  return 'transaction of %s' % tx.date.strftime('%Y-%m-%d')
+
+
+def FormatProblem(problem):
+  return '%s: %s' % (FormatSource(problem.transaction), problem.message)
+
+
+def _GoogleSplitUnits(held, acquired):
+  """Applies the stock split to the units held."""
+  if 'GOOG' in held:
+    held['GOOGL'] = held['GOOG']
+    acquired.add('GOOGL')
+
+
+# The effect of each corporate action on the units held, as functions of the
+# dict of units held by symbol and the set of symbols ever acquired.
+UNIT_EFFECTS = {
+  acb.engine.GoogleSplit: _GoogleSplitUnits,
+}
+
+
+def _RunningSums(codes, values, start):
+  """Returns the running sums of |values| grouped by |codes|.
+
+  Args:
+    codes: An array of group indices.
+    values: An array of values of the same length.
+    start: An array of the initial sum of each group.
+
+  Returns:
+    An array with the sum of each group after each value.
+  """
+  order = numpy.argsort(codes, kind='mergesort')
+  sorted_codes = codes[order]
+  sums = numpy.cumsum(values[order])
+  # Subtract the sum preceding the first value of each group.
+  first = numpy.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
+  before = numpy.r_[0.0, sums][numpy.flatnonzero(first)]
+  group = numpy.cumsum(first) - 1
+  running = numpy.empty(len(values))
+  running[order] = sums - before[group] + start[sorted_codes]
+  return running
+
+
+def _HeldUnits(codes, delta, start):
+  """Returns the units held of each group of |codes| around each change.
+
+  A sale of more units than are held leaves none held, rather than a negative
+  number, so that each oversale is measured against what was actually held.
+  With S the running sums of |delta|, the units held after each change are S
+  less the lowest of 0 and the sums so far.
+
+  Args:
+    codes: An array of group indices.
+    delta: An array of the changes in units held, of the same length.
+    start: An array of the initial units held of each group, none negative.
+
+  Returns:
+    A tuple of arrays of the units held before and after each change.
+  """
+  sums = _RunningSums(codes, delta, start)
+  order = numpy.argsort(codes, kind='mergesort')
+  sorted_sums = sums[order]
+  sorted_codes = codes[order]
+  first = numpy.flatnonzero(
+      numpy.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+  floor = numpy.empty(len(sums))
+  for group in numpy.split(numpy.arange(len(sums)), first[1:]):
+    floor[group] = numpy.minimum(
+        numpy.minimum.accumulate(sorted_sums[group]), 0.0)
+  # The floor preceding each change, which is 0 before the first of a group.
+  floor_before = numpy.r_[0.0, floor[:-1]]
+  floor_before[first] = 0.0
+  before = numpy.empty(len(sums))
+  after = numpy.empty(len(sums))
+  before[order] = sorted_sums - delta[order] - floor_before
+  after[order] = sorted_sums - floor
+  return before, after
+
+
+def _CheckSegment(txs, held, acquired, problems):
+  """Checks a run of transactions between corporate actions.
+
+  Updates |held| and |acquired| to the state following the run.
+  """
+  symbols = sorted(set(tx.symbol for tx in txs))
+  index = dict((sym, i) for i, sym in enumerate(symbols))
+  codes = numpy.array([index[tx.symbol] for tx in txs], dtype=int)
+  types = numpy.array([tx.type for tx in txs], dtype=object)
+  units = numpy.array([tx.units for tx in txs], dtype=float)
+
+  acquisitions = ((types == acb.common.TRANS_ACQUIRE) |
+                  (types == acb.common.TRANS_BUY))
+  sells = types == acb.common.TRANS_SELL
+  returns = types == acb.common.TRANS_CAPITAL_RETURN
+  unknown = ~numpy.array([t in KNOWN_TYPES for t in types], dtype=bool)
+
+  delta = (numpy.where(acquisitions, units, 0.0) -
+           numpy.where(sells, units, 0.0))
+  start = numpy.array([held.get(sym, 0.0) for sym in symbols])
+  before, after = _HeldUnits(codes, delta, start)
+  was_acquired = numpy.array([sym in acquired for sym in symbols])
+  count = _RunningSums(codes, acquisitions.astype(float),
+                       was_acquired.astype(float))
+
+  oversold = sells & (before + delta < -EPSILON)
+  orphaned = returns & (count == 0)
+
+  for i in numpy.flatnonzero(unknown | oversold | orphaned):
+    tx = txs[i]
+    if unknown[i]:
+      problems.append(Problem(tx, 'Unknown transaction type: %s' % tx.type))
+    elif oversold[i]:
+      message = 'Sale of %s units of %s exceeds the %s units held.' % (
+          tx.units, tx.symbol, before[i])
+      problems.append(Problem(tx, message))
+    else:
+      problems.append(Problem(tx, 'Capital return on %s, which was never '
+                                  'acquired.' % tx.symbol))
+
+  # Carry the state of each symbol to the next run.
+  last = numpy.zeros(len(symbols), dtype=int)
+  numpy.maximum.at(last, codes, numpy.arange(len(codes)))
+  for i, sym in enumerate(symbols):
+    held[sym] = after[last[i]]
+    if count[last[i]] > 0:
+      acquired.add(sym)
+
+
+def Validate(txs):
+  """Checks the sorted list of transactions and transaction functors |txs|.
+
+  Returns:
+    The list of Problem found, in transaction order.
+  """
+  problems = []
+  held = {}
+  acquired = set()
+  segment = []
+  for tx in list(txs) + [None]:
+    if tx is not None and type(tx) != acb.engine.TransactionFunctor:
+      segment.append(tx)
+      continue
+    if segment:
+      _CheckSegment(segment, held, acquired, problems)
+      segment = []
+    if tx is not None and tx.function in UNIT_EFFECTS:
+      UNIT_EFFECTS[tx.function](held, acquired)
+  LOGGER.debug('Validated %d transactions, %d problems found.',
+               len(txs), len(problems))
+  return problems
+
+
+def Check(txs):
+  """Raises a ValidationError if there are problems with |txs|."""
+  problems = Validate(txs)
+  if problems:
+    raise ValidationError(problems)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""Daily valuation of a portfolio from a local file of prices.
+
+Combines the history of ACBs from the engine with daily prices and the noon
+conversion rates to produce daily book value, market value and unrealized
+gains per property and for the whole portfolio. All series are forward-filled
+and computed as arrays over the whole history at once.
+
+The price file is a CSV file with a header row of 'Date,Symbol,Price,Currency'
+and a row per property per day, with dates as YYYY-MM-DD. Days without a
+price use the most recent earlier price.
+"""
+
+import csv
+import logging
+
+from collections import namedtuple
+
+import numpy
+
+import acb.currency
+import acb.engine
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Daily valuation series. |days| is an array of datetime64[D], and |symbols|
+# a list of properties. The per property series are arrays of shape
+# (len(symbols), len(days)), and the portfolio series are arrays of shape
+# (len(days),). All values are in CAD. Market values are NaN when there is no
+# price for a property that is held.
+Valuation = namedtuple(
+    'Valuation',
+    'days symbols units book market unrealized '
+    'portfolio_book portfolio_market portfolio_unrealized')
+
+
+class AcbHistory(acb.engine.Listener):
+  """Records the ACB of each property after every event."""
+
+  def __init__(self):
+    # Lists of (date, units, cost), by symbol.
+    self.history = {}
+
+  def _Record(self, date, symbol, a):
+    self.history.setdefault(symbol, []).append((date, a.units, a.cost))
+
+  def OnAcquisition(self, event):
+    self._Record(event.date, event.symbol, event.acb)
+
+  def OnDisposition(self, event):
+    self._Record(event.date, event.symbol, event.acb)
+
+  def OnCapitalReturn(self, event):
+    self._Record(event.date, event.symbol, event.acb)
+
+  def OnCorporateAction(self, event):
+    for symbol, a in event.acbs.iteritems():
+      self._Record(event.date, symbol, a)
+
+
+def ReadPrices(src):
+  """Reads a price file from the IO object |src|.
+
+  Returns:
+    A dict of symbols to tuples of (currency, dates, prices), where the dates
+    are a sorted array of datetime64[D].
+  """
+  rows = {}
+  for d in csv.DictReader(src):
+    rows.setdefault(d['Symbol'], []).append(
+        (d['Date'], float(d['Price']), d.get('Currency') or 'USD'))
+  prices = {}
+  for symbol, r in rows.iteritems():
+    r.sort()
+    currencies = set(c for _, _, c in r)
+    if len(currencies) != 1:
+      raise Exception('Prices of %s are in several currencies.' % symbol)
+    prices[symbol] = (currencies.pop(),
+                      numpy.array([d for d, _, _ in r], dtype='datetime64[D]'),
+                      numpy.array([p for _, p, _ in r]))
+  return prices
+
+
+def _ForwardFill(dates, values, days, default):
+  """Returns |values| at |dates| forward-filled onto |days|.
+
+  Days preceding the first date are |default|. Of several values on the same
+  date, the last one is used.
+  """
+  index = numpy.searchsorted(dates, days, side='right') - 1
+  return numpy.where(index >= 0, values[numpy.maximum(index, 0)], default)
+
+
+def Value(history, prices, start=None, end=None):
+  """Computes the daily valuation of a portfolio.
+
+  Args:
+    history: An AcbHistory of a ProcessTransactions run.
+    prices: The prices, as returned by ReadPrices.
+    start: The first day to value. Defaults to the first event.
+    end: The last day to value. Defaults to the last event or price.
+
+  Returns:
+    A Valuation.
+  """
+  symbols = sorted(history.history.iterkeys())
+  hist = {}
+  for symbol in symbols:
+    h = history.history[symbol]
+    hist[symbol] = (
+        numpy.array([d.strftime('%Y-%m-%d') for d, _, _ in h],
+                    dtype='datetime64[D]'),
+        numpy.array([u for _, u, _ in h], dtype=float),
+        numpy.array([c for _, _, c in h], dtype=float))
+
+  if start is None:
+    start = min(h[0][0] for h in hist.itervalues())
+  if end is None:
+    end = max([h[0][-1] for h in hist.itervalues()] +
+              [p[1][-1] for s, p in prices.iteritems() if s in hist])
+  days = numpy.arange(numpy.datetime64(start, 'D'),
+                      numpy.datetime64(end, 'D') + 1)
+  LOGGER.debug('Valuing %d properties over %d days.', len(symbols), len(days))
+
+  shape = (len(symbols), len(days))
+  units = numpy.zeros(shape)
+  book = numpy.zeros(shape)
+  market = numpy.zeros(shape)
+  rates = {}
+  for i, symbol in enumerate(symbols):
+    dates, u, c = hist[symbol]
+    units[i] = _ForwardFill(dates, u, days, 0.0)
+    book[i] = _ForwardFill(dates, c, days, 0.0)
+    if symbol not in prices:
+      market[i] = numpy.nan
+      continue
+    currency, price_dates, p = prices[symbol]
+    if currency not in rates:
+      rates[currency] = acb.currency.GetDailyNoonRates(currency, 'CAD', days)
+    market[i] = units[i] * _ForwardFill(price_dates, p, days, numpy.nan) * (
+        rates[currency])
+
+  # Properties that aren't held have no market value, even without a price.
+  market[units == 0] = 0.0
+  unrealized = market - book
+  return Valuation(days, symbols, units, book, market, unrealized,
+                   book.sum(axis=0), market.sum(axis=0),
+                   unrealized.sum(axis=0))
+
+
+def WriteCsv(valuation, dst):
+  """Writes |valuation| to the IO object |dst| as CSV.
+
+  There is a row per day and property, and a row per day for the portfolio
+  as a whole with the symbol '*'.
+  """
+  w = csv.writer(dst)
+  w.writerow(['Date', 'Symbol', 'Units', 'Book', 'Market', 'Unrealized'])
+  v = valuation
+  for j, day in enumerate(v.days):
+    day = str(day)
+    for i, symbol in enumerate(v.symbols):
+      w.writerow([day, symbol, v.units[i, j], '%.2f' % v.book[i, j],
+                  '%.2f' % v.market[i, j], '%.2f' % v.unrealized[i, j]])
+    w.writerow([day, '*', '', '%.2f' % v.portfolio_book[j],
+                '%.2f' % v.portfolio_market[j],
+                '%.2f' % v.portfolio_unrealized[j]])